@@ -0,0 +1,109 @@
+import sys
+
+sys.path.append('../')
+
+import gc
+import random
+import string
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+from my_http.my_http import HTTPRequest, HTTPResponse, HTTPHelper
+
+
+class LegacyHTTPRequest:
+    # the previous implementation of HTTPRequest(raw_payload=...)
+    def __init__(self, raw_payload, https=True):
+        self.raw_payload = raw_payload
+        self.https = https
+        self.path = ""
+        request_parts = raw_payload.split(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
+        self.content = (HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR).join(request_parts[1:])
+        headers = request_parts[0].split(HTTPHelper.SEPARATOR)
+        info_parts = headers[0].split(b" ")
+        self.method = info_parts[0].decode()
+        self.http_version = info_parts[-1].decode()
+        self.headers = HTTPHelper.parse_headers(headers[1:])
+        self.url = "https://" + self.headers.get("host", "") + b" ".join(info_parts[1:-1]).decode()
+        self.url_parsed = urlparse(self.url)
+
+    def __hash__(self):
+        return hash((self.content, self.method, self.url, self.http_version, str(self.headers)))
+
+    def __eq__(self, obj):
+        return hash(self) == hash(obj)
+
+
+class LegacyHTTPResponse:
+    # the previous implementation of HTTPResponse(raw_payload=...)
+    def __init__(self, raw_payload):
+        self.raw_payload = raw_payload
+        request_parts = raw_payload.split(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
+        self.content = (HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR).join(request_parts[1:])
+        headers = request_parts[0].split(HTTPHelper.SEPARATOR)
+        info_parts = headers[0].split(b" ")
+        self.http_version = info_parts[0].decode()
+        self.status_code = int(info_parts[1].decode())
+        self.status_text = info_parts[2].decode() if len(info_parts) > 2 else ""
+        self.headers = HTTPHelper.parse_headers(headers[1:])
+
+    def __hash__(self):
+        return hash((self.status_code, self.http_version, str(self.headers), self.content))
+
+    def __eq__(self, obj):
+        return hash(self) == hash(obj)
+
+
+def random_string(length):
+    return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def build_payloads(count):
+    payloads = []
+    for i in range(count):
+        token = random_string(32).encode()
+        request = b"GET /api/items/%d?session=%s&page=%d HTTP/1.1\r\nHost: a.com\r\nUser-Agent: Mozilla/5.0\r\n" \
+                  b"Accept: application/json\r\nCookie: sid=%s; theme=dark\r\n\r\n" % (i, token, i % 10, token)
+        body = b'{"id": %d, "token": "%s", "items": [%s]}' % (i, random_string(32).encode(),
+                                                            b", ".join(b"%d" % j for j in range(50)))
+        response = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n" \
+                   b"Set-Cookie: sid=%s; Path=/\r\n\r\n%s" % (len(body), token, body)
+        payloads.append((request, response))
+    return payloads
+
+
+def measure(name, request_class, response_class, payloads):
+    gc.collect()
+    tracemalloc.start()
+    # fresh copies of the payloads, like the ones the stream reassembly hands over, which are freed unless kept
+    pairs = [(request_class(raw_payload=bytes(bytearray(request))),
+              response_class(raw_payload=bytes(bytearray(response)))) for request, response in payloads]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # like the membership checks of the nonce sets and the result file
+    start = time.perf_counter()
+    for _ in range(3):
+        messages = set()
+        for request, response in pairs:
+            messages.add(request)
+            messages.add(response)
+    hashing = (time.perf_counter() - start) / 3
+    print("%-8s %8.1f MB %8.3f s per set of all messages" % (name, memory / 1024 ** 2, hashing))
+    return memory
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(0)
+    payloads = build_payloads(count)
+    print("%d pairs, %.1f MB of raw payloads" % (count, sum(len(request) + len(response)
+                                                            for request, response in payloads) / 1024 ** 2))
+    legacy = measure("legacy", LegacyHTTPRequest, LegacyHTTPResponse, payloads)
+    current = measure("slots", HTTPRequest, HTTPResponse, payloads)
+    print("Memory reduction: %.0f%%" % (100 * (1 - current / legacy)))
+
+
+if __name__ == "__main__":
+    main()
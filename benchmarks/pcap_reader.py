@@ -0,0 +1,36 @@
+import sys
+
+sys.path.append('../')
+
+import time
+
+from helper.parsing_helper import ParsingHelper as pa
+from helper.pcap_helper import PcapHelper
+
+
+def measure(name, segments):
+    start = time.perf_counter()
+    count = 0
+    payload_bytes = 0
+    for segment in segments:
+        count += 1
+        payload_bytes += len(segment[-1])
+    duration = time.perf_counter() - start
+    print("%-8s %10d packets %12d payload bytes %8.3f s %12.0f packets/s" %
+          (name, count, payload_bytes, duration, count / duration if duration > 0 else 0))
+    return duration
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: %s <capture.pcap|capture.pcapng>" % sys.argv[0])
+        exit(-1)
+    file = sys.argv[1]
+
+    native = measure("native", PcapHelper.iter_tcp_segments(file))
+    scapy = measure("scapy", pa.iter_pcap_segments_scapy(file))
+    print("Speedup: %.1fx" % (scapy / native if native > 0 else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import sys
+
+sys.path.append('../')
+
+import random
+import string
+import time
+
+from my_http.my_http import HTTPRequest
+from helper.template_helper import RequestTemplates
+
+
+def prepare_request_by_replacing(request, real_nonces):
+    # the previous implementation of tool.prepare_request_for_replay
+    req_headers = request.get_headers_for_replay()
+    req_content = request.content
+    req_url = request.url
+    for old_nonce in sorted(list(real_nonces), key=len, reverse=True):
+        new_nonce = real_nonces[old_nonce]
+        req_headers = {header: req_headers[header].replace(old_nonce, new_nonce) for header in req_headers}
+        if 'content-length' in req_headers:
+            del req_headers['content-length']
+        if 'date' in req_headers:
+            del req_headers['date']
+        req_content = req_content.replace(old_nonce.encode(), new_nonce.encode())
+        req_url = req_url.replace(old_nonce, new_nonce)
+    return req_url, req_headers, req_content
+
+
+def random_string(length):
+    return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def build_request(nonces, header_count, body_size):
+    headers = b"".join(b"X-Header-%d: %s %s\r\n" % (i, random_string(20).encode(), random.choice(nonces).encode())
+                       for i in range(header_count))
+    body = bytearray()
+    while len(body) < body_size:
+        body += random_string(200).encode() + random.choice(nonces).encode()
+    return HTTPRequest(raw_payload=b"POST /api?token=%s HTTP/1.1\r\nHost: a.com\r\n%s\r\n%s" %
+                                   (nonces[0].encode(), headers, bytes(body)))
+
+
+def measure(name, function, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = function()
+    duration = (time.perf_counter() - start) / repetitions
+    print("%-10s %10.3f ms per request" % (name, duration * 1000))
+    return duration, result
+
+
+def main():
+    nonce_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    body_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256 * 1024
+    random.seed(0)
+    nonces = [random_string(24) for _ in range(nonce_count)]
+    real_nonces = {nonce: random_string(24) for nonce in nonces}
+    request = build_request(nonces, 30, body_size)
+    print("%d nonces, %d headers, %d body bytes" % (nonce_count, len(request.headers), len(request.content)))
+
+    replacing, expected = measure("replace", lambda: prepare_request_by_replacing(request, real_nonces), 20)
+    templates = RequestTemplates(set(nonces))
+    compiling, _ = measure("compile", lambda: RequestTemplates(set(nonces)).render(request, real_nonces), 5)
+    templates.render(request, real_nonces)
+    splicing, result = measure("template", lambda: templates.render(request, real_nonces), 20)
+    assert result == expected
+    print("Speedup per replay: %.1fx" % (replacing / splicing if splicing > 0 else 0))
+
+
+if __name__ == "__main__":
+    main()
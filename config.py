@@ -35,13 +35,92 @@ def CUSTOM_FILTER(pair):
     return False
 
 
-# the time between pruning runs to avoid rate limiting
-# in seconds
 CONFIGURATION = {
-    "TIME_BETWEEN_DYNAMIC_PRUNING_RUNS": 10,
     "DEBUG": True,
     "SHOULD_PRINT_URLS_FOR_MATCHINGS": True,
     "ONLY_NONCE_VALUES_IN_OUTPUT": False,
-    "SHOULD_ABSTRACT_OUTPUT": False
+    "SHOULD_ABSTRACT_OUTPUT": False,
+    # reassemble the TCP flows of pcap files instead of treating every packet as a complete HTTP message
+    "STREAMING_PCAP_PARSING": True,
+    # "native" reads pcap/pcapng files through a memory map and only decodes the needed headers,
+    # "scapy" dissects every packet with scapy
+    "PCAP_READER": "native",
+    # worker processes used to parse both input files concurrently, pcap files are sharded by TCP flow
+    # 1 parses everything sequentially in the main process, None uses all cores
+    "PARSING_PROCESSES": 1,
+    # cache parsed and pruned traces, matchings and nonces between runs on the same input files
+    "USE_ANALYSIS_CACHE": True,
+    "ANALYSIS_CACHE_DIRECTORY": ".protex_cache",
+    "ANALYSIS_CACHE_MAX_SIZE": 2 * 1024 ** 3,
+    # worker processes computing the differences of matched pairs during nonce discovery, every matched pair is only
+    # compared once for all candidate matchings, None uses all cores
+    "NONCE_DISCOVERY_PROCESSES": 1,
+    # bytes the parsed response bodies (text, JSON) shared by nonce detection and retrieval may roughly take,
+    # the least recently used ones are parsed again when needed
+    "BODY_VIEW_CACHE_SIZE": 512 * 1024 ** 2,
+    # "dp" enumerates only maximal matchings with a dynamic programming search, "z3" enumerates all with z3
+    "MATCHING_BACKEND": "dp",
+    # order equally long matchings of the dp backend by the similarity of their pairs, most similar first
+    "RANK_MATCHINGS": True,
+    # after a successful replay, enumerate the unranked matchings again to report how many replays the ranking saved
+    "REPORT_SAVED_REPLAYS": False,
+    # exclude the pairing a failed replay diverged at from all further matchings
+    "LEARN_NOGOODS": True,
+    # connection pooling of the client that replays the traces, timeouts are in seconds
+    "REPLAY_CLIENT": {
+        "HTTP2": True,
+        "PER_ORIGIN_POOLS": False,
+        "MAX_CONNECTIONS": 100,
+        "MAX_KEEPALIVE_CONNECTIONS": 20,
+        "KEEPALIVE_EXPIRY": 5.0,
+        "TIMEOUT": 30.0,
+        "CONNECT_TIMEOUT": 10.0,
+        "MAX_CONCURRENCY_PER_ORIGIN": 6,
+        "MAX_REDIRECTS": 10
+    },
+    # "sequential" sends one request after the other, "async" sends requests whose nonces don't depend on each
+    # other concurrently
+    "REPLAY_MODE": "sequential",
+    # "linear" tries to remove one pair per replay, "ddmin" removes chunks of pairs and halves them on failure
+    "DYNAMIC_PRUNING_STRATEGY": "ddmin",
+    # removal candidates replayed at once during dynamic pruning, every replay uses its own connections
+    "PARALLEL_PRUNING_REPLAYS": 1,
+    # maximum number of requests sent during dynamic pruning, None for no limit
+    "PRUNING_REQUEST_BUDGET": None,
+    # keep the pairs on a nonce chain to the oracle pair during dynamic pruning without trying to remove them
+    "KEEP_REQUIRED_PAIRS": True,
+    # shorter nonce values (like "1" or "true") don't link pairs in the nonce dataflow graph
+    "DATAFLOW_MIN_NONCE_LENGTH": 5,
+    # file the nonce dataflow graph of the pruned trace is written to, as DOT for .dot files and JSON otherwise
+    "DATAFLOW_GRAPH_FILE": None,
+    # append-only journal of all replays, tool.py --resume continues an interrupted run from it, None to disable
+    "REPLAY_JOURNAL_FILE": "replay_journal.jsonl",
+    # stop a replay as soon as the oracle can't succeed anymore: at a status code of the oracle pair that doesn't
+    # match the recording or at a missing nonce of one of these types that the oracle pair needs, directly or not
+    "FAIL_FAST": {
+        "ENABLED": True,
+        "STATUS_MISMATCH": True,
+        "MISSING_NONCE_TYPES": {
+            "json": True,
+            "form-urlencoded": True,
+            "html-hidden-input": True,
+            "meta-redirect": True,
+            "location": True,
+            # servers often don't set a cookie again if the request already carries one
+            "set-cookie": False
+        }
+    },
+    # per origin token bucket throttling all replayed requests to avoid rate limiting, rates are in requests per
+    # second, throttled requests (429/503) are retried up to MAX_RETRIES times
+    "RATE_LIMIT": {
+        "ENABLED": True,
+        "INITIAL_RATE": 2.0,
+        "MIN_RATE": 0.1,
+        "MAX_RATE": 50.0,
+        "BURST": 5,
+        "ADDITIVE_INCREASE": 0.5,
+        "MULTIPLICATIVE_DECREASE": 0.5,
+        "MAX_RETRIES": 3
+    }
 }
 
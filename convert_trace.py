@@ -0,0 +1,20 @@
+#!/usr/bin/python
+
+from sys import argv, exit
+
+from helper.parsing_helper import ParsingHelper as pa
+from helper.trace_index_helper import TraceIndexHelper
+
+
+def main():
+    if len(argv) != 3 or not TraceIndexHelper.is_index_file(argv[2]):
+        print("Usage: %s <input.pcap|input.pcapng|input.pkl> <output.ptx>" % argv[0])
+        exit(-1)
+
+    pairs = pa.parse_file(argv[1])
+    TraceIndexHelper.write_index_file(pairs, argv[2])
+    print("Converted %d HTTP request/response pairs to %s" % (len(pairs), argv[2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import hashlib
+import marshal
+import os
+import pickle
+
+from config import CONFIGURATION, USE_ORACLE, ORACLE, CUSTOM_FILTER
+from helper.matching_helper import Matching
+from helper.trace_index_helper import TraceIndexHelper
+
+# bump whenever the format of a cached value changes
+CACHE_VERSION = 4
+
+
+class CacheHelper:
+    """
+    A content addressed on-disk cache. Values are pickled into one file per key,
+    the least recently used files are evicted once the cache grows beyond ANALYSIS_CACHE_MAX_SIZE bytes.
+    """
+
+    @staticmethod
+    def file_digest(file):
+        digest = hashlib.sha256()
+        with open(file, "rb") as opened_file:
+            for chunk in iter(lambda: opened_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def function_fingerprint(function):
+        return hashlib.sha256(marshal.dumps(function.__code__)).hexdigest()
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(repr((CACHE_VERSION,) + parts).encode()).hexdigest()
+
+    @staticmethod
+    def path(key):
+        return os.path.join(CONFIGURATION["ANALYSIS_CACHE_DIRECTORY"], key + ".pkl")
+
+    @staticmethod
+    def load(key):
+        path = CacheHelper.path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        os.utime(path)  # mark as recently used for the eviction
+        return value
+
+    @staticmethod
+    def store(key, value):
+        os.makedirs(CONFIGURATION["ANALYSIS_CACHE_DIRECTORY"], exist_ok=True)
+        path = CacheHelper.path(key)
+        with open(path + ".tmp", "wb") as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        CacheHelper.evict()
+
+    @staticmethod
+    def evict():
+        directory = CONFIGURATION["ANALYSIS_CACHE_DIRECTORY"]
+        entries = []
+        for name in os.listdir(directory):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= CONFIGURATION["ANALYSIS_CACHE_MAX_SIZE"]:
+                break
+            os.remove(os.path.join(directory, name))
+            size -= entry_size
+
+
+class AnalysisCache:
+    """
+    Caches the parsed and the statically pruned traces, the candidate matchings and the found nonces of a pair of
+    input files. The keys consist of the hashes of the input files and the configuration each result depends on,
+    so changing e.g. only the ORACLE reuses everything up to the replay.
+    Indexed trace files are opened again instead of caching their pairs, which would load all bodies from the memory
+    map, only the positions of the statically pruned pairs are cached for them.
+    """
+
+    def __init__(self, file1, file2):
+        self.enabled = CONFIGURATION["USE_ANALYSIS_CACHE"]
+        self.files = [file1, file2]
+        self.trace1 = None
+        self.trace2 = None
+        self.keys = None
+        if self.enabled:
+            self.compute_keys()
+
+    def compute_keys(self):
+        file1, file2 = self.files
+        parse_fingerprint = (CONFIGURATION["STREAMING_PCAP_PARSING"],)
+        prune_fingerprint = (CacheHelper.function_fingerprint(USE_ORACLE),
+                             CacheHelper.function_fingerprint(CUSTOM_FILTER))
+        self.keys = {"parsed": [], "pruned": []}
+        for file in [file1, file2]:
+            parsed_key = CacheHelper.make_key("parsed", CacheHelper.file_digest(file), parse_fingerprint)
+            self.keys["parsed"].append(parsed_key)
+            self.keys["pruned"].append(CacheHelper.make_key("pruned", parsed_key, prune_fingerprint))
+        self.matchings_key = CacheHelper.make_key("matchings", *self.keys["pruned"],
+                                                  CONFIGURATION["MATCHING_BACKEND"], CONFIGURATION["RANK_MATCHINGS"])
+        # the nogoods are learned from replays judged by the oracle, the matchings are kept when only it changes
+        self.nogoods_key = CacheHelper.make_key("nogoods", *self.keys["pruned"],
+                                                CacheHelper.function_fingerprint(ORACLE))
+
+    @property
+    def input_key(self):
+        # identifies the statically pruned traces, which results like the replay journal refer to by index
+        if self.keys is None:
+            self.compute_keys()
+        return CacheHelper.make_key("inputs", *self.keys["pruned"])
+
+    @staticmethod
+    def oracle_fingerprint():
+        return CacheHelper.function_fingerprint(ORACLE)
+
+    def load_trace(self, stage, index):
+        if not self.enabled:
+            return None
+        if not TraceIndexHelper.is_index_file(self.files[index]):
+            return CacheHelper.load(self.keys[stage][index])
+        positions = CacheHelper.load(self.keys[stage][index]) if stage == "pruned" else None
+        if positions is None:
+            return None
+        parsed = TraceIndexHelper.parse_index_file(self.files[index])
+        return [parsed[position] for position in positions]
+
+    def store_trace(self, stage, index, pairs, parsed=None):
+        if not self.enabled:
+            return
+        if not TraceIndexHelper.is_index_file(self.files[index]):
+            CacheHelper.store(self.keys[stage][index], pairs)
+        elif stage == "pruned":
+            positions = {id(pair): position for position, pair in enumerate(parsed)}
+            CacheHelper.store(self.keys[stage][index], [positions[id(pair)] for pair in pairs])
+
+    def set_traces(self, trace1, trace2):
+        self.trace1 = trace1
+        self.trace2 = trace2
+        self.indices1 = {id(pair): i for i, pair in enumerate(trace1)}
+        self.indices2 = {id(pair): i for i, pair in enumerate(trace2)}
+        self.request_indices = {id(request): i for i, (request, _) in enumerate(trace1)}
+        self.response_indices = {id(response): i for i, (_, response) in enumerate(trace1)}
+
+    def matching_to_indices(self, matching):
+        return tuple((self.indices1[id(pair1)], self.indices2[id(pair2)]) for pair1, pair2 in matching)
+
+    def matchings(self, generate_matchings, nogoods):
+        """
+        Yields the cached matchings first and only continues the (expensive) generator once they are used up.
+        The nogoods learned under the same ORACLE are added to nogoods before and cached matchings containing one
+        are skipped. The cached enumeration only counts as complete if it was finished under the same nogoods.
+        """
+        if not self.enabled:
+            yield from generate_matchings()
+            return
+
+        known, complete, enumeration_nogoods = CacheHelper.load(self.matchings_key) or ([], False, set())
+        known_nogoods = (CacheHelper.load(self.nogoods_key) or set()) if CONFIGURATION["LEARN_NOGOODS"] else set()
+        nogoods.update(known_nogoods)
+        changed = False
+        try:
+            for indices, score in known:
+                if any(pair in nogoods for pair in indices):
+                    continue
+                yield Matching([(self.trace1[i], self.trace2[j]) for i, j in indices], score)
+            if complete and enumeration_nogoods == nogoods:
+                return
+
+            # the generator may skip matchings it learned to be wrong, so the known ones are skipped by content
+            known_indices = {indices for indices, _ in known}
+            for matching in generate_matchings():
+                indices = self.matching_to_indices(matching)
+                if indices in known_indices:
+                    continue
+                known.append((indices, getattr(matching, "score", 0.0)))
+                changed = True
+                yield matching
+            complete = changed = True
+            enumeration_nogoods = set(nogoods)
+        finally:
+            if changed:
+                CacheHelper.store(self.matchings_key, (known, complete, enumeration_nogoods))
+            if not nogoods <= known_nogoods:
+                CacheHelper.store(self.nogoods_key, set(nogoods))
+
+    def find_nonces(self, matching, find_nonces):
+        if not self.enabled:
+            return find_nonces(matching)
+
+        key = CacheHelper.make_key("nonces", *self.keys["pruned"], self.matching_to_indices(matching))
+        cached = CacheHelper.load(key)
+        if cached is not None:
+            request_nonces, response_nonces = cached
+            return ({(self.trace1[i][0], val, nonce_type, k) for i, val, nonce_type, k in request_nonces},
+                    {(self.trace1[i][1], val, nonce_type, k) for i, val, nonce_type, k in response_nonces})
+
+        request_nonces, response_nonces = find_nonces(matching)
+        CacheHelper.store(key, (
+            {(self.request_indices[id(r)], val, nonce_type, k) for r, val, nonce_type, k in request_nonces},
+            {(self.response_indices[id(r)], val, nonce_type, k) for r, val, nonce_type, k in response_nonces}
+        ))
+        return request_nonces, response_nonces
@@ -0,0 +1,129 @@
+import json
+import re
+from collections import deque
+
+from config import CONFIGURATION
+from helper.json_helper import JSONHelper
+from my_http.body_view import BodyView
+
+INFINITE_DISTANCE = float("inf")
+
+
+class NonceDataflowGraph:
+    """
+    Links the responses that supply a nonce to the later requests that carry its value.
+    Nodes are the indices of the pairs in the trace, an edge (supplier, consumer, nonce) means that the request of
+    consumer carries the value of nonce = (value, type, key) from the response of supplier.
+    nonce_values returns the forms a nonce value can appear in. A request carries a value if it is one of its fields
+    (path segments, query parameters, cookies, other headers, form parameters or JSON leaves of the body) or is
+    delimited by non-alphanumeric characters inside of one, values shorter than DATAFLOW_MIN_NONCE_LENGTH never count.
+    """
+
+    def __init__(self, trace, response_nonce_set, nonce_values):
+        self.trace = trace
+        self.edges = []
+        self.suppliers = [set() for _ in trace]
+        self.consumers = [set() for _ in trace]
+
+        min_length = CONFIGURATION["DATAFLOW_MIN_NONCE_LENGTH"]
+        supplied = []
+        for index, (request, response) in enumerate(trace):
+            fields = "\n".join(self.request_fields(request))
+            for supplier, nonce, pattern in supplied:
+                if pattern is not None and pattern.search(fields):
+                    self.edges.append((supplier, index, nonce))
+                    self.suppliers[index].add(supplier)
+                    self.consumers[supplier].add(index)
+
+            for nonce in response_nonce_set.get(response, []):
+                values = [value for value in nonce_values(nonce[0]) if len(value) >= min_length]
+                pattern = re.compile("(?<![0-9A-Za-z])(?:%s)(?![0-9A-Za-z])" % "|".join(map(re.escape, values))) \
+                    if values else None
+                supplied.append((index, nonce, pattern))
+
+    @staticmethod
+    def request_fields(request):
+        fields = request.get_url_path_parts() + list(request.get_url_query_params().values())
+        fields += request.get_cookies_pairs().values()
+        fields += [value for key, value in request.headers.items() if key != "cookie"]
+        view = BodyView.of(request)
+        document = view.json if "json" in view.content_type else None
+        if document is not None:
+            fields += [leaf if isinstance(leaf, str) else json.dumps(leaf) for _, leaf in JSONHelper.flatten(document)]
+        elif view.content_type == "application/x-www-form-urlencoded":
+            fields += view.form_params.values()
+        else:
+            fields.append(view.text)
+        return fields
+
+    def required_for(self, target):
+        # the target and all pairs on a nonce chain leading to it
+        required = {target}
+        queue = deque([target])
+        while queue:
+            for supplier in self.suppliers[queue.popleft()]:
+                if supplier not in required:
+                    required.add(supplier)
+                    queue.append(supplier)
+        return required
+
+    def distances(self, target):
+        # the number of nonce edges between the target and every pair, ignoring their direction
+        distances = [INFINITE_DISTANCE] * len(self.trace)
+        distances[target] = 0
+        queue = deque([target])
+        while queue:
+            index = queue.popleft()
+            for neighbour in self.suppliers[index] | self.consumers[index]:
+                if distances[neighbour] == INFINITE_DISTANCE:
+                    distances[neighbour] = distances[index] + 1
+                    queue.append(neighbour)
+        return distances
+
+    def removal_order(self, target, excluded):
+        # the pairs farthest away from the target are the most likely to be unneeded, so they are tried first
+        distances = self.distances(target)
+        candidates = [index for index in range(len(self.trace)) if index not in excluded]
+        return sorted(candidates, key=lambda index: -distances[index])
+
+    def to_json(self, target, kept=None):
+        distances = self.distances(target)
+        required = self.required_for(target)
+        return json.dumps({
+            "nodes": [{
+                "index": index,
+                "method": request.method,
+                "url": request.url,
+                "oracle": index == target,
+                "required": index in required,
+                "distance": None if distances[index] == INFINITE_DISTANCE else distances[index],
+                "kept": None if kept is None else index in kept
+            } for index, (request, _) in enumerate(self.trace)],
+            "edges": [{"from": supplier, "to": consumer, "value": value, "type": nonce_type, "key": key}
+                      for supplier, consumer, (value, nonce_type, key) in self.edges]
+        }, indent=2)
+
+    def to_dot(self, target, kept=None):
+        required = self.required_for(target)
+        lines = ["digraph nonces {", "    node [shape=box];"]
+        for index, (request, _) in enumerate(self.trace):
+            attributes = ['label="%d %s %s"' % (index, request.method, self.escape(request.url))]
+            if index == target:
+                attributes.append("color=red")
+            if index in required:
+                attributes.append("style=filled")
+            if kept is not None and index not in kept:
+                attributes.append("fontcolor=gray")
+            lines.append("    %d [%s];" % (index, ", ".join(attributes)))
+        for supplier, consumer, (_, nonce_type, key) in self.edges:
+            lines.append('    %d -> %d [label="%s %s"];' % (supplier, consumer, nonce_type, self.escape(str(key))))
+        lines.append("}")
+        return "\n".join(lines)
+
+    def export(self, file, target, kept=None):
+        with open(file, "w") as opened_file:
+            opened_file.write(self.to_dot(target, kept) if file.endswith(".dot") else self.to_json(target, kept))
+
+    @staticmethod
+    def escape(string):
+        return string.replace("\\", "\\\\").replace('"', '\\"')
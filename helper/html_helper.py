@@ -0,0 +1,72 @@
+from lxml import etree
+
+# bytes fed to the parser at once
+CHUNK_SIZE = 64 * 1024
+
+
+class NonceMarkerCollector:
+    """
+    lxml parser target collecting the first meta refresh element and all hidden inputs of an HTML document
+    without building a tree. The path of an input without id equals the one lxml's getpath returns for it:
+    a position is only added to a step if its parent has further children with the same tag, which is only
+    known once the parent is closed, so the paths are assembled in close().
+    """
+
+    def __init__(self):
+        # one [tag, position, child tag counts] entry per open element
+        self.stack = [[None, 0, {}]]
+        self.meta_refresh = None
+        self.hidden_inputs = []
+
+    def start(self, tag, attributes):
+        parent_counts = self.stack[-1][2]
+        parent_counts[tag] = parent_counts.get(tag, 0) + 1
+        self.stack.append([tag, parent_counts[tag], {}])
+
+        if tag == "input" and attributes.get("type") == "hidden":
+            if attributes.get("id"):
+                path = "//input[@id='" + attributes.get("id") + "']"
+            else:
+                # the steps share the count dicts of their parents, which are complete in close()
+                path = [(step_tag, position, self.stack[i][2]) for i, (step_tag, position, _) in
+                        enumerate(self.stack[1:])]
+            self.hidden_inputs.append((path, attributes.get("value")))
+        elif tag == "meta" and self.meta_refresh is None and attributes.get("http-equiv") == "refresh":
+            self.meta_refresh = dict(attributes)
+
+    def end(self, tag):
+        self.stack.pop()
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        hidden_inputs = {}
+        for path, value in self.hidden_inputs:
+            if not isinstance(path, str):
+                path = "".join("/%s[%d]" % (tag, position) if parent_counts[tag] > 1 else "/" + tag
+                               for tag, position, parent_counts in path)
+            # like the XPath lookup of the path, the first input with an id wins
+            hidden_inputs.setdefault(path, value)
+        return self.meta_refresh, hidden_inputs
+
+
+class HTMLHelper:
+    @staticmethod
+    def might_contain_nonce_markers(content):
+        return b"hidden" in content or b"refresh" in content
+
+    @staticmethod
+    def extract_nonce_markers(content):
+        """
+        Returns the attributes of the first meta refresh element (or None) and a map from the path of every hidden
+        input to its value, the paths work as XPath on the DOM of the content. The content is parsed in a single
+        streaming pass, and not at all if it contains neither marker.
+        """
+        if not HTMLHelper.might_contain_nonce_markers(content):
+            return None, {}
+        parser = etree.HTMLParser(target=NonceMarkerCollector())
+        view = memoryview(content)
+        for start in range(0, len(content), CHUNK_SIZE):
+            parser.feed(bytes(view[start:start + CHUNK_SIZE]))
+        return parser.close()
@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+
+
+class ReplayJournal:
+    """
+    An append-only journal with one JSON line per replay, holding its kind ("matching" or "pruning"), the key of
+    the replayed candidate, the status of every replayed request, the retrieved nonces and the verdict of the ORACLE.
+    Every line is flushed to disk before the replay counts as done, so after a crash the journal can be loaded to
+    continue without sending a replay twice. A partially written last line is ignored.
+    Every run appends a "run" header line instead of truncating the file, so the journal of an interrupted run
+    survives a run without resume. Resuming loads the entries since the header of the last run that didn't resume.
+    The header holds the identity of the run (e.g. the inputs and the oracle), entries of runs with another
+    identity are ignored, since their keys and verdicts don't apply. Their number is kept in ignored.
+    """
+
+    def __init__(self, file, resume=False, identity=None):
+        self.file = file
+        self.entries = {}
+        self.ignored = 0
+        identity = identity or {}
+        # entries of journals without run headers can't be attributed
+        same_run = False
+        if resume and os.path.exists(file):
+            with open(file) as opened_file:
+                for line in opened_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry["kind"] == "run":
+                        if not entry["resume"]:
+                            self.entries.clear()
+                            self.ignored = 0
+                        same_run = entry.get("identity") == identity
+                        continue
+                    if same_run:
+                        self.entries[self.entry_key(entry["kind"], entry["key"])] = entry
+                    else:
+                        self.ignored += 1
+        self.opened_file = open(file, "a")
+        self.lock = threading.Lock()
+        if self.opened_file.tell() > 0:
+            with open(file, "rb") as opened_file:
+                opened_file.seek(-1, os.SEEK_END)
+                if opened_file.read(1) != b"\n":
+                    # ends the partially written line, so the header isn't appended to it
+                    self.opened_file.write("\n")
+        self.write(dict(kind="run", resume=resume, identity=identity, started=time.strftime("%Y-%m-%dT%H:%M:%S")))
+
+    @staticmethod
+    def entry_key(kind, key):
+        return kind, json.dumps(key)
+
+    def lookup(self, kind, key):
+        return self.entries.get(self.entry_key(kind, key))
+
+    def record(self, kind, key, **values):
+        entry = dict(kind=kind, key=key, **values)
+        with self.lock:
+            self.write(entry)
+            self.entries[self.entry_key(kind, key)] = entry
+
+    def write(self, entry):
+        self.opened_file.write(json.dumps(entry) + "\n")
+        self.opened_file.flush()
+        os.fsync(self.opened_file.fileno())
+
+    def close(self):
+        self.opened_file.close()
@@ -0,0 +1,175 @@
+import json
+import re
+from json.decoder import scanstring
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# everything up to the next bracket outside of a string, so a container is skipped with one match per bracket
+# (unrolled, so it can't backtrack exponentially on truncated content)
+UP_TO_BRACKET = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.DOTALL)
+SCALAR = re.compile(r"[^,\]}\s]*")
+decoder = json.JSONDecoder()
+
+
+class JSONHelper:
+    """
+    Flattening, diffing and path lookups of parsed JSON documents. Paths are tuples of the keys and list indices
+    leading to a leaf, path_string turns them into the "|key|0|key" form nonce keys use.
+    """
+
+    @staticmethod
+    def path_string(path):
+        return "".join("|%s" % step for step in path)
+
+    @staticmethod
+    def parse_path_string(path):
+        return path.split("|")[1:]
+
+    @staticmethod
+    def strip_prefix(content):
+        # some APIs prefix their JSON with )]}' or )]}" and a line break against JSON hijacking
+        line_end = content.find("\n")
+        if line_end == 4 or (line_end == -1 and len(content) == 4):
+            return content[5:]
+        return content
+
+    @staticmethod
+    def children(value):
+        if isinstance(value, dict):
+            return value.items()
+        return enumerate(value)
+
+    @staticmethod
+    def flatten(document):
+        """
+        Yields (path, leaf) for every leaf of the document in document order, without recursion.
+        """
+        stack = [((), document)]
+        while stack:
+            path, value = stack.pop()
+            if isinstance(value, (dict, list)):
+                # reversed, so the first child is popped first
+                stack.extend(reversed([(path + (step,), child) for step, child in JSONHelper.children(value)]))
+            else:
+                yield path, value
+
+    @staticmethod
+    def diff(document1, document2):
+        """
+        Yields (path, leaf1, leaf2) for every path that leads to different leaves in both documents.
+        Both documents are walked together, equal subtrees are skipped after a comparison in C.
+        Subtrees that are a dict in one document and a list in the other are compared by their flattened string
+        paths, where index 0 and key "0" are the same.
+        """
+        stack = [((), document1, document2)]
+        while stack:
+            path, value1, value2 = stack.pop()
+            if value1 == value2:
+                continue
+            container1, container2 = isinstance(value1, (dict, list)), isinstance(value2, (dict, list))
+            if not container1 and not container2:
+                yield path, value1, value2
+            elif container1 and container2:
+                if type(value1) is type(value2):
+                    children2 = value2 if isinstance(value2, dict) else dict(enumerate(value2))
+                    stack.extend(reversed([(path + (step,), child, children2[step])
+                                           for step, child in JSONHelper.children(value1) if step in children2]))
+                else:
+                    leaves2 = {JSONHelper.path_string(subpath): leaf for subpath, leaf in JSONHelper.flatten(value2)}
+                    for subpath, leaf1 in JSONHelper.flatten(value1):
+                        leaf2 = leaves2.get(JSONHelper.path_string(subpath), leaf1)
+                        if leaf1 != leaf2:
+                            yield path + subpath, leaf1, leaf2
+
+    @staticmethod
+    def lookup(document, path):
+        """
+        The leaf at a path string in a parsed document, None if the path doesn't lead to a leaf.
+        """
+        value = document
+        for step in JSONHelper.parse_path_string(path):
+            if isinstance(value, dict) and step in value:
+                value = value[step]
+            elif isinstance(value, list) and step.isdigit() and int(step) < len(value):
+                value = value[int(step)]
+            else:
+                return None
+        return None if isinstance(value, (dict, list)) else value
+
+    @staticmethod
+    def extract(content, path):
+        """
+        The leaf at a path string in unparsed JSON content, None if the path doesn't lead to a leaf.
+        Only the leaf is decoded, everything else is skipped while scanning, so the content is never parsed as a
+        whole. Raises ValueError for malformed content on the way to the leaf.
+        """
+        content = JSONHelper.strip_prefix(content)
+        position = WHITESPACE.match(content, 0).end()
+        for step in JSONHelper.parse_path_string(path):
+            if content.startswith("{", position):
+                position = JSONHelper.find_member(content, position, step)
+            elif content.startswith("[", position) and step.isdigit():
+                position = JSONHelper.find_item(content, position, int(step))
+            else:
+                return None
+            if position is None:
+                return None
+        if content.startswith(("{", "["), position):
+            return None
+        return decoder.raw_decode(content, position)[0]
+
+    @staticmethod
+    def find_member(content, position, key):
+        # the position of the value of the last member with the key in the object at position, like json.loads
+        # keeps the last of duplicated keys
+        found = None
+        position = WHITESPACE.match(content, position + 1).end()
+        while not content.startswith("}", position):
+            if not content.startswith('"', position):
+                raise ValueError("Expected a member name at %d" % position)
+            name, position = scanstring(content, position + 1)
+            position = WHITESPACE.match(content, position).end()
+            if not content.startswith(":", position):
+                raise ValueError("Expected ':' at %d" % position)
+            position = WHITESPACE.match(content, position + 1).end()
+            if name == key:
+                found = position
+            position = JSONHelper.skip_separator(content, JSONHelper.skip_value(content, position))
+        return found
+
+    @staticmethod
+    def find_item(content, position, index):
+        # the position of the item with the index in the array at position
+        position = WHITESPACE.match(content, position + 1).end()
+        for _ in range(index):
+            if content.startswith("]", position):
+                return None
+            position = JSONHelper.skip_separator(content, JSONHelper.skip_value(content, position))
+        return None if content.startswith("]", position) else position
+
+    @staticmethod
+    def skip_separator(content, position):
+        position = WHITESPACE.match(content, position).end()
+        if content.startswith(",", position):
+            position = WHITESPACE.match(content, position + 1).end()
+        return position
+
+    @staticmethod
+    def skip_value(content, position):
+        # the end of the value at position
+        if content.startswith('"', position):
+            return scanstring(content, position + 1)[1]
+        if not content.startswith(("{", "["), position):
+            return SCALAR.match(content, position).end()
+        depth = 0
+        end = position
+        while True:
+            match = UP_TO_BRACKET.match(content, end)
+            if match is None:
+                raise ValueError("Unterminated container at %d" % position)
+            end = match.end()
+            if match.group(1) in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return end
@@ -1,5 +1,25 @@
+import heapq
+from array import array
+from bisect import bisect_right
+from itertools import count
+
 from helper.parsing_helper import ParsingHelper as pa
-from z3 import *
+from config import CONFIGURATION
+
+try:
+    from z3 import Solver, IntVector, And, Or, Not, Implies, sat
+except ImportError:  # z3 is only needed for the z3 matching backend
+    Solver = None
+
+
+class Matching(list):
+    """
+    A list of matched (pair1, pair2) tuples with the summed similarity of the matched pairs as score.
+    """
+
+    def __init__(self, pairs, score=0.0):
+        super().__init__(pairs)
+        self.score = score
 
 
 class MatchingHelper:
@@ -23,14 +43,208 @@ class MatchingHelper:
                and len(request1.get_url_query_params()) == len(request2.get_url_query_params())
 
     @staticmethod
-    def match_two_traces(pairs1, pairs2):
-        possible_matches = []
-        for i in range(len(pairs1)):
-            possible_matches.append([])
-            for j in range(len(pairs2)):
-                req2 = pairs2[j][0]
-                if MatchingHelper.url_similar(pairs1[i][0], req2):
-                    possible_matches[-1] += [j]
+    def request_signature(request):
+        # two requests are url_similar exactly if their signatures are equal
+        return request.method, \
+               request.url_parsed.scheme + "://" + request.url_parsed.netloc, \
+               len(request.get_url_path_parts()), \
+               len(request.get_url_query_params())
+
+    @staticmethod
+    def get_signature_ids(pairs1, pairs2):
+        interned = {}
+        signature_ids1 = [interned.setdefault(MatchingHelper.request_signature(req), len(interned))
+                          for req, _ in pairs1]
+        signature_ids2 = [interned.setdefault(MatchingHelper.request_signature(req), len(interned))
+                          for req, _ in pairs2]
+        return signature_ids1, signature_ids2
+
+    @staticmethod
+    def get_possible_matches(pairs1, pairs2, signature_ids=None):
+        if signature_ids is None:
+            signature_ids = MatchingHelper.get_signature_ids(pairs1, pairs2)
+        signature_ids1, signature_ids2 = signature_ids
+        buckets = {}
+        for j, signature_id in enumerate(signature_ids2):
+            buckets.setdefault(signature_id, []).append(j)
+        # requests with the same signature share their (read only) candidate list
+        return [buckets.get(signature_id, []) for signature_id in signature_ids1]
+
+    @staticmethod
+    def body_shape(http):
+        # only the headers and the indexed body length, the ranking must not load the bodies of indexed traces
+        content_type = http.headers.get("content-type", "").split(";")[0].strip().lower()
+        return content_type, http.get_content_length()
+
+    @staticmethod
+    def shape_similarity(shape1, shape2):
+        content_type1, length1 = shape1
+        content_type2, length2 = shape2
+        if content_type1 != content_type2 or (length1 == 0) != (length2 == 0):
+            return 0.0
+        if length1 == length2:
+            return 1.0
+        return min(length1, length2) / max(length1, length2)
+
+    @staticmethod
+    def jaccard(set1, set2):
+        if len(set1) == 0 and len(set2) == 0:
+            return 1.0
+        return len(set1 & set2) / len(set1 | set2)
+
+    @staticmethod
+    def pair_features(pair):
+        request, response = pair
+        return (request.get_url_path_parts(), frozenset(request.get_url_query_params()),
+                MatchingHelper.body_shape(request), MatchingHelper.body_shape(response), response.status_code)
+
+    @staticmethod
+    def pair_similarity(features1, features2):
+        """
+        Similarity of two url_similar pairs between 0 and 1, the mean of
+            - the fraction of equal path tokens
+            - the overlap of the query parameter names
+            - the agreement of the request and response body shapes (content-type and body length)
+            - the agreement of the status codes (200 and 302 count as half, since they are interchangeable on replay)
+        """
+        path1, query1, request_shape1, response_shape1, status1 = features1
+        path2, query2, request_shape2, response_shape2, status2 = features2
+
+        path = 1.0 if len(path1) == 0 else sum(p1 == p2 for p1, p2 in zip(path1, path2)) / len(path1)
+        query = MatchingHelper.jaccard(query1, query2)
+        shape = (MatchingHelper.shape_similarity(request_shape1, request_shape2) +
+                 MatchingHelper.shape_similarity(response_shape1, response_shape2)) / 2
+        if status1 == status2:
+            status = 1.0
+        elif status1 in [200, 302] and status2 in [200, 302]:
+            status = 0.5
+        else:
+            status = 0.0
+        return (path + query + shape + status) / 4
+
+    @staticmethod
+    def match_two_traces(pairs1, pairs2, backend=None, ranked=None, nogoods=None):
+        """
+        Enumerates order preserving matchings of the two traces, longest first.
+        The "dp" backend only yields maximal matchings, ranked by their similarity score among equally long ones.
+        The "z3" backend yields every matching in the order z3 finds them.
+        nogoods is a set of (index1, index2) pairings that no matching may contain,
+        it can grow while the matchings are enumerated.
+        """
+        if backend is None:
+            backend = CONFIGURATION["MATCHING_BACKEND"]
+        if ranked is None:
+            ranked = CONFIGURATION["RANK_MATCHINGS"]
+        if nogoods is None:
+            nogoods = set()
+        if backend == "z3":
+            return MatchingHelper.match_two_traces_z3(pairs1, pairs2, nogoods)
+        return MatchingHelper.match_two_traces_dp(pairs1, pairs2, ranked, nogoods)
+
+    @staticmethod
+    def match_two_traces_dp(pairs1, pairs2, ranked=True, nogoods=frozenset()):
+        """
+        Best first (k-best) search over partial matchings that are extended from left to right.
+        Every matched pair is worth 1 plus its similarity scaled below 1/(min(n, m) + 1), so the length of a matching
+        always dominates its score. A partial matching ending in (i, j) is bounded by its value plus the best
+        weighted common subsequence of pairs1[i+1:] and pairs2[j+1:], so complete matchings are found best first.
+        These bounds are only computed for the compatible cells, in the manner of Hunt-Szymanski, with a max Fenwick
+        tree over the columns, so time and memory grow with the number of candidates instead of n * m.
+        A pair is only appended if no compatible pair fits in between, which makes every result maximal.
+        Pairings in nogoods count as incompatible. Since that changes which matchings are maximal, the search starts
+        over whenever nogoods were learned, skipping the matchings it already yielded.
+        """
+        # the compatible cells, each row's columns sorted, with the signature ids computed once
+        possible_matches = MatchingHelper.get_possible_matches(pairs1, pairs2)
+        n, m = len(pairs1), len(pairs2)
+
+        similarities = {}
+        if ranked:
+            features1 = [MatchingHelper.pair_features(pair) for pair in pairs1]
+            features2 = [MatchingHelper.pair_features(pair) for pair in pairs2]
+            for i in range(n):
+                for j in possible_matches[i]:
+                    similarities[(i, j)] = MatchingHelper.pair_similarity(features1[i], features2[j])
+        scale = 1.0 / (min(n, m) + 1)
+
+        def weight(i, j):
+            return 1.0 + similarities.get((i, j), 0.0) * scale
+
+        # tree[p] is the best value of a matching starting in one of the columns m - p to m - p + lowbit(p) - 1
+        tree = array("d", [0.0] * (m + 1))
+
+        def insert(j, value):
+            position = m - j
+            while position <= m:
+                tree[position] = max(tree[position], value)
+                position += position & -position
+
+        def best_after(j):
+            # the value of the best matching of the rows inserted so far and pairs2[j+1:]
+            value = 0.0
+            position = m - 1 - j
+            while position > 0:
+                value = max(value, tree[position])
+                position -= position & -position
+            return value
+
+        # tails[i][k] is the value of the best matching of pairs1[i+1:] and pairs2[possible_matches[i][k]+1:]
+        tails = [None] * n
+        for i in range(n - 1, -1, -1):
+            columns = possible_matches[i]
+            tails[i] = array("d", [best_after(j) for j in columns])
+            for j, tail in zip(columns, tails[i]):
+                insert(j, tail + weight(i, j))
+
+        def expand(last_i, last_j):
+            # (i, j) can follow (last_i, last_j) if no compatible pair lies strictly in between,
+            # i.e. no earlier row has a compatible column in (last_j, j)
+            children = []
+            first_column = m
+            for i in range(last_i + 1, n):
+                columns = possible_matches[i]
+                row_first_column = m
+                for k in range(bisect_right(columns, last_j), len(columns)):
+                    j = columns[k]
+                    if j > first_column:
+                        break
+                    if (i, j) not in nogoods:
+                        row_first_column = min(row_first_column, j)
+                        children.append((i, j, k))
+                first_column = min(first_column, row_first_column)
+            # the matching can end here if no compatible pair is left
+            return children, first_column == m
+
+        yielded = set()
+        while True:
+            known_nogoods = len(nogoods)
+            counter = count()
+            heap = [(-best_after(-1), 0, next(counter), -1, -1, (), 0.0, False)]
+            while heap and len(nogoods) == known_nogoods:
+                _, _, _, last_i, last_j, matching, value, complete = heapq.heappop(heap)
+                if complete:
+                    if len(matching) > 0 and matching not in yielded:
+                        yielded.add(matching)
+                        yield Matching([(pairs1[i], pairs2[j]) for i, j in matching],
+                                       sum(similarities.get(pair, 0.0) for pair in matching))
+                    continue
+
+                children, can_end = expand(last_i, last_j)
+                if can_end:
+                    heapq.heappush(heap, (-value, -len(matching), next(counter), last_i, last_j, matching, value,
+                                          True))
+                for i, j, k in children:
+                    child_value = value + weight(i, j)
+                    heapq.heappush(heap, (-(child_value + tails[i][k]), -(len(matching) + 1), next(counter), i, j,
+                                          matching + ((i, j),), child_value, False))
+            if len(nogoods) == known_nogoods:
+                return
+
+    @staticmethod
+    def match_two_traces_z3(pairs1, pairs2, nogoods=frozenset()):
+        if Solver is None:
+            raise ImportError("The z3 matching backend needs the z3-solver package")
+        possible_matches = MatchingHelper.get_possible_matches(pairs1, pairs2)
 
         def init_solver(length):
             solver = Solver()
@@ -66,10 +280,20 @@ class MatchingHelper:
                 matching.append((pairs1[p1], pairs2[p2]))
             return matching
 
+        def add_nogood_constraints(solver, matched1, matched2, length, added_nogoods):
+            for i, j in nogoods - added_nogoods:
+                solver.add(And([Not(And(matched1[k] == i, matched2[k] == j)) for k in range(length)]))
+                added_nogoods.add((i, j))
+
         max_length = min(len(pairs1), len(pairs2))
         for length in range(max_length, 0, -1):
             solver, matched1, matched2 = init_solver(length)
-            while solver.check() == sat:
+            added_nogoods = set()
+            while True:
+                # nogoods can be learned while the matchings are consumed
+                add_nogood_constraints(solver, matched1, matched2, length, added_nogoods)
+                if solver.check() != sat:
+                    break
                 m = solver.model()
                 add_model_constraint(solver, m, matched1, matched2, length)
                 yield get_matching_from_model(m, matched1, matched2, length)
@@ -1,2 +1,8 @@
 class OracleNotUsedException(Exception):
     pass
+
+
+class ReplayAbortedException(Exception):
+    def __init__(self, index):
+        super().__init__("Replay aborted at pair %d" % index)
+        self.index = index
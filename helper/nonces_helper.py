@@ -1,8 +1,13 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from helper.matching_helper import MatchingHelper as ma
-from helper.parsing_helper import ParsingHelper as pa
+from helper.json_helper import JSONHelper
+from my_http.body_view import BodyView
 from config import CONFIGURATION
 
-from lxml import etree
+# missing pair differences needed to compute them in the worker processes instead of the main process
+PARALLEL_DIFF_THRESHOLD = 64
 
 
 class NoncesHelper:
@@ -24,6 +29,13 @@ class NoncesHelper:
 
     @staticmethod
     def find_nonces_in_requests(request1, request2, found_nonces, request_nonces):
+        for nonce in NoncesHelper.diff_requests(request1, request2):
+            _, val, _, _ = nonce
+            if val not in found_nonces:
+                request_nonces.add(nonce)
+
+    @staticmethod
+    def diff_requests(request1, request2):
         debug = CONFIGURATION["DEBUG"]
 
         req1, req2 = request1, request2
@@ -54,95 +66,69 @@ class NoncesHelper:
         elif debug:
             print("Request to %s match" % req1.url)
 
-        for nonce in new_nonces:
+        return new_nonces
+
+    @staticmethod
+    def find_nonces_in_responses(response1, response2, found_nonces, response_nonces):
+        for nonce in NoncesHelper.diff_responses(response1, response2):
             _, val, _, _ = nonce
             if val not in found_nonces:
-                request_nonces.add(nonce)
+                if CONFIGURATION["DEBUG"]:
+                    print("Found new nonce: ", nonce)
+                found_nonces.add(val)
+                response_nonces.add(nonce)
 
     @staticmethod
-    def find_nonces_in_responses(response1, response2, found_nonces, response_nonces):
+    def diff_responses(response1, response2):
         res1, res2 = response1, response2
         new_nonces = set()
         # check response
+        view1, view2 = BodyView.of(res1), BodyView.of(res2)
         if "content-type" in res1.headers and res1.content != res2.content:
-            content_type = res1.headers["content-type"].split(";")[0]  # remove charset
+            content_type = view1.content_type
 
             # check json content
-            if content_type == "application/json":
-                json1 = pa.flatten_json(res1.get_json_content())
-                json2 = pa.flatten_json(res2.get_json_content())
-
-                json1_map = {key: value for key, value in json1}
-                json2_map = {key: value for key, value in json2}
-
-                new_nonces = new_nonces.union(
-                    NoncesHelper.find_nonces_in_map(res1, json1_map, json2_map, "json", "JSON"))
+            if content_type == "application/json" and view2.content_type == content_type:
+                json1, json2 = view1.json, view2.json
+                if json1 is not None and json2 is not None:
+                    for path, value1, value2 in JSONHelper.diff(json1, json2):
+                        key = JSONHelper.path_string(path)
+                        new_nonces.add((res1, str(value1), "json", key))
+                        if CONFIGURATION["DEBUG"]:
+                            print("JSON different: '%s' = '%s' | '%s'" % (key, value1, value2))
 
             # check for-urlencoded content
             elif content_type == "application/x-www-form-urlencoded":
-                params1 = res1.get_url_encoded_content()
-                params2 = res2.get_url_encoded_content()
+                params2 = view2.form_params if view2.content_type == content_type else {}
                 new_nonces = new_nonces.union(
-                    NoncesHelper.find_nonces_in_map(res1, params1, params2, "form-urlencoded",
+                    NoncesHelper.find_nonces_in_map(res1, view1.form_params, params2, "form-urlencoded",
                                                     "www-form-urlencoded param")
                 )
 
             # html content
             elif content_type == "text/html":
-                dom1 = etree.HTML(res1.content)
-                dom2 = etree.HTML(res2.content)
-
                 # check meta data redirects in html response
-                urls1 = dom1.xpath("//meta[@http-equiv='refresh']")
-                urls2 = dom2.xpath("//meta[@http-equiv='refresh']")
-                if len(urls1) > 0 and len(urls2) > 0:
-                    meta_element1 = urls1[0]
-                    meta_element2 = urls2[0]
-                    if meta_element1.get("data-url"):
-                        url1 = meta_element1.get("data-url")
-                    else:
-                        url1 = meta_element1.get("content").split(";url=")[-1]
-
-                    if meta_element2.get("data-url"):
-                        url2 = meta_element2.get("data-url")
-                    else:
-                        url2 = meta_element2.get("content").split(";url=")[-1]
-
-                    if url1 and url2 and url1 != url2:
-                        url1 = url1.replace("&amp;", "&")
-                        url2 = url2.replace("&amp;", "&")
-                        url_diffs = ma.match_urls(url1, url2)
-                        for val, part, key in url_diffs:
-                            part = "meta-redirect-" + part
-                            new_nonces.add((res1, val, part, key))
+                url1 = view1.meta_refresh_url
+                url2 = view2.meta_refresh_url
+                if url1 and url2 and url1 != url2:
+                    url1 = url1.replace("&amp;", "&")
+                    url2 = url2.replace("&amp;", "&")
+                    url_diffs = ma.match_urls(url1, url2)
+                    for val, part, key in url_diffs:
+                        part = "meta-redirect-" + part
+                        new_nonces.add((res1, val, part, key))
 
                 # check hidden input fields (csrf tokens)
-                hidden_inputs1 = dom1.xpath("//input[@type='hidden']")
-                hidden_inputs2 = dom2.xpath("//input[@type='hidden']")
-
-                tree1 = etree.ElementTree(dom1)
-                tree2 = etree.ElementTree(dom2)
-
-                path_map1 = {tree1.getpath(inp)
-                             if not inp.get("id")
-                             else "//input[@id='" + inp.get("id") + "']":
-
-                                 inp.get("value") for inp in hidden_inputs1}
-
-                path_map2 = {tree2.getpath(inp)
-                             if not inp.get("id")
-                             else "//input[@id='" + inp.get("id") + "']":
-
-                                 inp.get("value") for inp in hidden_inputs2}
-
+                path_map1 = view1.hidden_inputs
+                path_map2 = view2.hidden_inputs
                 for path in path_map1:
                     if path in path_map2 and path_map1[path] != path_map2[path]:
                         new_nonces.add((res1, path_map1[path], "html-hidden-input", path))
 
         # check sent cookies
         if "set-cookie" in res1.headers:
-            set_cookies1 = res1.get_set_cookies()
-            set_cookies2 = res2.get_set_cookies()
+            set_cookies1 = view1.set_cookies
+            set_cookies2 = view2.set_cookies
             new_nonces = new_nonces.union(
                 NoncesHelper.find_nonces_in_map(res1, set_cookies1, set_cookies2, "set-cookie", "Set-Cookie")
             )
@@ -159,15 +145,9 @@ class NoncesHelper:
                         new_nonces.add((res1, val, part, key))
 
         def redirect_check(meta_redirect_res, http_redirect_res):
-            dom = etree.HTML(meta_redirect_res.content)
-            meta_url_elements = dom.xpath("//meta[@http-equiv='refresh']")
-            if len(meta_url_elements) == 0:
+            meta_url = BodyView.of(meta_redirect_res).meta_refresh_url
+            if meta_url is None:
                 return
-            meta_url_element = meta_url_elements[0]
-            if meta_url_element.get("data-url"):
-                meta_url = meta_url_element.get("data-url")
-            else:
-                meta_url = meta_url_element.get("content").split(";url=")[-1]
 
             redirect_url = http_redirect_res.headers["location"]
             url_diffs = ma.match_urls(meta_url, redirect_url)
@@ -180,13 +160,14 @@ class NoncesHelper:
         elif res1.status_code == 302 and res1.status_code == 200:
             redirect_check(res2, res1)
 
-        for nonce in new_nonces:
-            _, val, _, _ = nonce
-            if val not in found_nonces:
-                if CONFIGURATION["DEBUG"]:
-                    print("Found new nonce: ", nonce)
-                found_nonces.add(val)
-                response_nonces.add(nonce)
+        return new_nonces
+
+    @staticmethod
+    def diff_pair(pair1, pair2):
+        # the differences without the messages, so they can be returned from worker processes
+        (req1, res1), (req2, res2) = pair1, pair2
+        return ({nonce[1:] for nonce in NoncesHelper.diff_requests(req1, req2)},
+                {nonce[1:] for nonce in NoncesHelper.diff_responses(res1, res2)})
 
     @staticmethod
     def find_nonces_in_map(http_message, map1, map2, identifier_string, human_string):
@@ -204,18 +185,71 @@ class NoncesHelper:
         return nonces
 
     @staticmethod
-    def find_nonces(matches):
+    def find_nonces(matches, diff_cache=None):
         # find all nonces as used in trace1
         found_nonces = set()
         request_nonces = set()
         response_nonces = set()
 
-        for (req1, res1), (req2, res2) in matches:
-            NoncesHelper.find_nonces_in_requests(req1, req2, found_nonces, request_nonces)
-            NoncesHelper.find_nonces_in_responses(res1, res2, found_nonces, response_nonces)
+        if diff_cache is None:
+            diff_cache = PairDiffCache(processes=1)
+        for ((req1, res1), _), (request_diffs, response_diffs) in zip(matches, diff_cache.diffs(matches)):
+            for val, id, key in request_diffs:
+                if val not in found_nonces:
+                    request_nonces.add((req1, val, id, key))
+            for val, id, key in response_diffs:
+                if val not in found_nonces:
+                    if CONFIGURATION["DEBUG"]:
+                        print("Found new nonce: ", (res1, val, id, key))
+                    found_nonces.add(val)
+                    response_nonces.add((res1, val, id, key))
 
         if CONFIGURATION["DEBUG"]:
             print("Client side nonces (%d) :" % len(request_nonces), request_nonces)
             print("Server side nonces (%d) :" % len(response_nonces), response_nonces)
 
         return request_nonces, response_nonces
+
+
+class PairDiffCache:
+    """
+    The differences of every matched (pair1, pair2) are computed once and shared by all matchings containing them,
+    the nonces of a matching only depend on them and the order of the matched pairs.
+    Differences not known yet are computed in a pool of NONCE_DISCOVERY_PROCESSES worker processes if there are
+    at least PARALLEL_DIFF_THRESHOLD of them.
+    """
+
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = CONFIGURATION["NONCE_DISCOVERY_PROCESSES"] or os.cpu_count()
+        self.processes = processes
+        self.executor = None
+        # (id(pair1), id(pair2)) -> (pair1, pair2, differences), the pairs keep the ids valid
+        self.entries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def diffs(self, matches):
+        missing = {(id(pair1), id(pair2)): (pair1, pair2) for pair1, pair2 in matches
+                   if (id(pair1), id(pair2)) not in self.entries}
+        if self.processes > 1 and len(missing) >= PARALLEL_DIFF_THRESHOLD:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.processes)
+            pairs1, pairs2 = zip(*missing.values())
+            computed = self.executor.map(NoncesHelper.diff_pair, pairs1, pairs2,
+                                         chunksize=max(1, len(missing) // (self.processes * 4)))
+        else:
+            computed = (NoncesHelper.diff_pair(pair1, pair2) for pair1, pair2 in missing.values())
+
+        for (key, (pair1, pair2)), differences in zip(missing.items(), computed):
+            self.entries[key] = pair1, pair2, differences
+        return [self.entries[(id(pair1), id(pair2))][2] for pair1, pair2 in matches]
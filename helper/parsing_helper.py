@@ -1,17 +1,41 @@
 import pickle
 import html
-from scapy.all import PcapReader
+import heapq
+import math
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from scapy.all import PcapReader, IP, IPv6, TCP
 from lxml import etree
 
 from my_http.my_http import HTTPRequest, HTTPResponse
+from helper.stream_helper import StreamHelper
+from helper.pcap_helper import PcapHelper, UnsupportedCaptureException
+from helper.trace_index_helper import TraceIndexHelper
+from helper.json_helper import JSONHelper
 from urllib.parse import urlparse
 from config import CONFIGURATION
 
+# segments sent to a shard worker at once
+SHARD_BATCH_SIZE = 1024
+# batches waiting for a shard worker before reading the capture blocks, this bounds the memory of the main process
+SHARD_QUEUE_LENGTH = 8
+# seconds between the checks whether a shard worker died while waiting for it
+SHARD_POLL_INTERVAL = 1.0
+
 
 class ParsingHelper:
     @staticmethod
     def parse_pcap_file(file):
-        packets = [ParsingHelper.unpack_to_http_payload(packet) for packet in ParsingHelper.read_pcap_file(file)]
+        if CONFIGURATION["STREAMING_PCAP_PARSING"]:
+            return ParsingHelper.parse_pcap_file_streaming(file)
+
+        if CONFIGURATION["PCAP_READER"] == "native":
+            packets = [(bytes(payload), dport == 443) for _, _, _, _, dport, _, _, payload in
+                       ParsingHelper.iter_pcap_segments(file) if len(payload) > 0]
+        else:
+            packets = [ParsingHelper.unpack_to_http_payload(packet) for packet in ParsingHelper.read_pcap_file(file)]
         parsed = ParsingHelper.parse_packets(packets)
         pairs = ParsingHelper.parse_http_pairs(parsed)
 
@@ -22,6 +46,113 @@ class ParsingHelper:
 
         return pairs
 
+    @staticmethod
+    def parse_pcap_file_streaming(file):
+        pairs = list(StreamHelper.iter_http_pairs(ParsingHelper.iter_pcap_segments(file)))
+
+        if CONFIGURATION["DEBUG"]:
+            print("HTTP request/response count %d" % len(pairs))
+
+        return pairs
+
+    @staticmethod
+    def parse_pcap_shard(shard, batches, results):
+        # runs in a shard worker: reassembles the flows of the batches until the None batch, sends back the keyed pairs
+        def iter_segments():
+            batch = batches.get()
+            while batch is not None:
+                yield from batch
+                batch = batches.get()
+
+        try:
+            # the flows still open at the end of the capture are finished after every segment of all shards
+            results.put((shard, list(StreamHelper.iter_positioned_http_pairs(iter_segments(), math.inf))))
+        except Exception as exception:
+            results.put((shard, exception))
+
+    @staticmethod
+    def parse_pcap_segments_sharded(segments, shards, batch_size=SHARD_BATCH_SIZE):
+        """
+        Reassembles and parses the segments in one worker process per shard of the TCP flows. The segments are sent
+        to the workers in bounded batches while they are read, so neither the capture nor a shard of it is ever kept
+        in the main process, which only remembers the shard of every flow.
+        """
+        batch_queues = [multiprocessing.Queue(SHARD_QUEUE_LENGTH) for _ in range(shards)]
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=ParsingHelper.parse_pcap_shard, args=(shard, batch_queues[shard],
+                                                                                         results), daemon=True)
+                   for shard in range(shards)]
+        for worker in workers:
+            worker.start()
+
+        def send(shard, batch):
+            while True:
+                try:
+                    return batch_queues[shard].put(batch, timeout=SHARD_POLL_INTERVAL)
+                except queue.Full:
+                    if not workers[shard].is_alive():
+                        raise RuntimeError("The parsing worker of shard %d died" % shard)
+
+        shard_results = {}
+        try:
+            for shard, batch in StreamHelper.iter_shard_batches(segments, shards, batch_size):
+                send(shard, batch)
+            for shard in range(shards):
+                send(shard, None)
+
+            while len(shard_results) < shards:
+                try:
+                    shard, pairs = results.get(timeout=SHARD_POLL_INTERVAL)
+                except queue.Empty:
+                    # a worker that sent its result exits with 0
+                    if any(workers[shard].exitcode not in [None, 0] for shard in range(shards)):
+                        raise RuntimeError("A parsing worker died")
+                    continue
+                if isinstance(pairs, Exception):
+                    raise pairs
+                shard_results[shard] = pairs
+        finally:
+            for worker in workers:
+                if len(shard_results) < shards:
+                    worker.terminate()
+                worker.join()
+        return ParsingHelper.merge_pcap_shards([shard_results[shard] for shard in range(shards)])
+
+    @staticmethod
+    def merge_pcap_shards(shard_results):
+        # every shard is already ordered by capture position
+        pairs = [(request, response) for _, request, response in heapq.merge(*shard_results, key=lambda p: p[0])]
+
+        if CONFIGURATION["DEBUG"]:
+            print("HTTP request/response count %d" % len(pairs))
+
+        return pairs
+
+    @staticmethod
+    def parse_files(files):
+        """
+        Parses all files concurrently with PARSING_PROCESSES worker processes.
+        The segments of pcap files are read in the main process and streamed to one worker per shard of their TCP
+        flows, every worker only reassembles and parses the flows of its shard. Other files are parsed as a whole in
+        a process pool meanwhile.
+        """
+        processes = CONFIGURATION["PARSING_PROCESSES"] or os.cpu_count()
+        if processes <= 1:
+            return [ParsingHelper.parse_file(file) for file in files]
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            sharded = [ParsingHelper.is_pcap_file(file) and CONFIGURATION["STREAMING_PCAP_PARSING"] for file in files]
+            jobs = [None if is_sharded else executor.submit(ParsingHelper.parse_file, file)
+                    for file, is_sharded in zip(files, sharded)]
+            results = []
+            for file, job in zip(files, jobs):
+                if job is None:
+                    results.append(ParsingHelper.parse_pcap_segments_sharded(ParsingHelper.iter_pcap_segments(file),
+                                                                             processes))
+                else:
+                    results.append(job.result())
+            return results
+
     @staticmethod
     def parse_pickle_file(file):
         with open(file, "rb") as input_file:
@@ -34,17 +165,55 @@ class ParsingHelper:
                  HTTPResponse(response_dict=pair["response"]))
                 for pair in pairs]
 
+    @staticmethod
+    def is_pcap_file(file):
+        return file.endswith("pcap") or file.endswith("pcapng")
+
     @staticmethod
     def parse_file(file):
-        if file.endswith("pcap"):
+        if ParsingHelper.is_pcap_file(file):
             return ParsingHelper.parse_pcap_file(file)
         elif file.endswith("pkl"):
             return ParsingHelper.parse_pickle_file(file)
+        elif TraceIndexHelper.is_index_file(file):
+            return TraceIndexHelper.parse_index_file(file)
 
     @staticmethod
     def unpack_to_http_payload(packet):
         return bytes(packet.load), packet.dport == 443
 
+    @staticmethod
+    def unpack_to_tcp_segment(packet):
+        if not packet.haslayer(TCP):
+            return None
+        if packet.haslayer(IP):
+            ip = packet[IP]
+        elif packet.haslayer(IPv6):
+            ip = packet[IPv6]
+        else:
+            return None
+        tcp = packet[TCP]
+        return float(packet.time), ip.src, tcp.sport, ip.dst, tcp.dport, tcp.seq, int(tcp.flags), bytes(tcp.payload)
+
+    @staticmethod
+    def iter_pcap_segments(file):
+        if CONFIGURATION["PCAP_READER"] == "native":
+            try:
+                for segment in PcapHelper.iter_tcp_segments(file):
+                    yield segment
+                return
+            except UnsupportedCaptureException as e:
+                print("Falling back to scapy: %s" % e)
+
+        yield from ParsingHelper.iter_pcap_segments_scapy(file)
+
+    @staticmethod
+    def iter_pcap_segments_scapy(file):
+        for packet in PcapReader(file):
+            segment = ParsingHelper.unpack_to_tcp_segment(packet)
+            if segment is not None:
+                yield segment
+
     @staticmethod
     def is_request(payload):
         return payload[:4] != b"HTTP"
@@ -83,22 +252,7 @@ class ParsingHelper:
 
     @staticmethod
     def flatten_json(json):
-        out = []
-
-        def flatten(subtree, name=""):
-            if isinstance(subtree, dict):
-                for node in subtree:
-                    flatten(subtree[node], "%s|%s" % (name, node))
-            elif isinstance(subtree, list):
-                i = 0
-                for node in subtree:
-                    flatten(node, "%s|%d" % (name, i))
-                    i += 1
-            else:
-                out.append((name, subtree))
-
-        flatten(json)
-        return out
+        return [(JSONHelper.path_string(path), value) for path, value in JSONHelper.flatten(json)]
 
     @staticmethod
     def parse_form_url_encoded(form_url_encoded):
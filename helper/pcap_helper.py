@@ -0,0 +1,244 @@
+import mmap
+import socket
+import struct
+
+PCAP_MAGIC_MICRO = 0xa1b2c3d4
+PCAP_MAGIC_NANO = 0xa1b23c4d
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_PACKET = 0x00000002
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW_OLD = 12
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = [0x8100, 0x88A8, 0x9100]
+IPV6_EXTENSION_HEADERS = [0, 43, 60]
+PROTOCOL_TCP = 6
+
+ETHERTYPE = struct.Struct("!H")
+IPV4_HEADER = struct.Struct("!BxHxxHxB")
+IPV6_HEADER = struct.Struct("!4xHB")
+TCP_HEADER = struct.Struct("!HHI4xB")  # data offset is the high nibble of the byte after the ack number
+TCP_FLAGS = struct.Struct("!B")
+
+
+class UnsupportedCaptureException(Exception):
+    pass
+
+
+class PcapHelper:
+    """
+    Reads TCP segments directly from a memory mapped pcap or pcapng file.
+    Only the link, IP and TCP headers are decoded, the payload is handed out as a memoryview into the mapping.
+    Segments have the same layout as ParsingHelper.unpack_to_tcp_segment, including the addresses as strings, so
+    both readers produce the same flow keys:
+        (timestamp, src, sport, dst, dport, seq, flags, payload)
+    """
+
+    @staticmethod
+    def iter_tcp_segments(file):
+        with open(file, "rb") as opened_file:
+            try:
+                mapped = mmap.mmap(opened_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return
+
+        data = memoryview(mapped)
+        try:
+            if len(data) < 4:
+                raise UnsupportedCaptureException("File is too short for a capture")
+            if struct.unpack_from("<I", data)[0] == PCAPNG_SECTION_HEADER:
+                records = PcapHelper.iter_pcapng_records(data)
+            else:
+                records = PcapHelper.iter_pcap_records(data)
+
+            yielded = False
+            for timestamp, link_type, frame in records:
+                try:
+                    segment = PcapHelper.decode_frame(link_type, frame)
+                except UnsupportedCaptureException:
+                    if not yielded:
+                        raise
+                    continue  # interfaces with other link types in a pcapng file
+                if segment is not None:
+                    yielded = True
+                    src, sport, dst, dport, seq, flags, payload = segment
+                    yield timestamp, src, sport, dst, dport, seq, flags, payload
+        finally:
+            data.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # payloads are still referenced, the mapping is closed once they are gone
+
+    @staticmethod
+    def iter_pcap_records(data):
+        magic = struct.unpack_from("<I", data)[0]
+        if magic in [PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO]:
+            endian = "<"
+        elif struct.unpack_from(">I", data)[0] in [PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO]:
+            endian = ">"
+            magic = struct.unpack_from(">I", data)[0]
+        else:
+            raise UnsupportedCaptureException("Unknown capture file magic %x" % magic)
+        resolution = 1e9 if magic == PCAP_MAGIC_NANO else 1e6
+
+        link_type = struct.unpack_from(endian + "I", data, 20)[0] & 0x0FFFFFFF
+        record_header = struct.Struct(endian + "IIII")
+        offset = 24
+        end = len(data)
+        while offset + record_header.size <= end:
+            seconds, fraction, captured_length, _ = record_header.unpack_from(data, offset)
+            offset += record_header.size
+            if offset + captured_length > end:
+                break  # truncated capture
+            yield seconds + fraction / resolution, link_type, data[offset:offset + captured_length]
+            offset += captured_length
+
+    @staticmethod
+    def iter_pcapng_records(data):
+        endian = "<"
+        interfaces = []
+        offset = 0
+        end = len(data)
+        while offset + 12 <= end:
+            block_type = struct.unpack_from(endian + "I", data, offset)[0]
+            if block_type == PCAPNG_SECTION_HEADER:
+                # every section can change the byte order and starts with new interfaces
+                if struct.unpack_from("<I", data, offset + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                    endian = "<"
+                else:
+                    endian = ">"
+                interfaces = []
+            block_length = struct.unpack_from(endian + "I", data, offset + 4)[0]
+            if block_length < 12 or offset + block_length > end:
+                break  # truncated or corrupt capture
+            body = offset + 8
+
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                link_type = struct.unpack_from(endian + "H", data, body)[0]
+                resolution = PcapHelper.parse_pcapng_resolution(data, body + 8, offset + block_length - 4, endian)
+                interfaces.append((link_type, resolution))
+            elif block_type == PCAPNG_ENHANCED_PACKET:
+                interface, high, low, captured_length = struct.unpack_from(endian + "IIII", data, body)
+                link_type, resolution = interfaces[interface]
+                start = body + 20
+                yield ((high << 32) | low) / resolution, link_type, data[start:start + captured_length]
+            elif block_type == PCAPNG_PACKET:
+                interface, _, high, low, captured_length = struct.unpack_from(endian + "HHIII", data, body)
+                link_type, resolution = interfaces[interface]
+                start = body + 20
+                yield ((high << 32) | low) / resolution, link_type, data[start:start + captured_length]
+            elif block_type == PCAPNG_SIMPLE_PACKET and interfaces:
+                original_length = struct.unpack_from(endian + "I", data, body)[0]
+                captured_length = min(original_length, block_length - 16)
+                link_type, _ = interfaces[0]
+                start = body + 4
+                yield 0.0, link_type, data[start:start + captured_length]
+
+            offset += block_length
+
+    @staticmethod
+    def parse_pcapng_resolution(data, offset, end, endian):
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + "HH", data, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:  # if_tsresol
+                value = data[offset + 4]
+                if value & 0x80:
+                    return float(2 ** (value & 0x7F))
+                return float(10 ** value)
+            offset += 4 + ((length + 3) & ~3)
+        return 1e6
+
+    @staticmethod
+    def decode_frame(link_type, frame):
+        if link_type == LINKTYPE_ETHERNET:
+            offset = 12
+            if len(frame) < offset + 2:
+                return None
+            ether_type = ETHERTYPE.unpack_from(frame, offset)[0]
+            while ether_type in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+                offset += 4
+                ether_type = ETHERTYPE.unpack_from(frame, offset)[0]
+            offset += 2
+        elif link_type in [LINKTYPE_RAW, LINKTYPE_RAW_OLD, LINKTYPE_IPV4, LINKTYPE_IPV6]:
+            offset = 0
+            if len(frame) < 1:
+                return None
+            ether_type = ETHERTYPE_IPV4 if frame[0] >> 4 == 4 else ETHERTYPE_IPV6
+        elif link_type in [LINKTYPE_NULL, LINKTYPE_LOOP]:
+            if len(frame) < 4:
+                return None
+            family = max(frame[0], frame[3])  # the family is in host byte order for NULL
+            ether_type = ETHERTYPE_IPV4 if family == 2 else ETHERTYPE_IPV6
+            offset = 4
+        elif link_type == LINKTYPE_LINUX_SLL:
+            if len(frame) < 16:
+                return None
+            ether_type = ETHERTYPE.unpack_from(frame, 14)[0]
+            offset = 16
+        elif link_type == LINKTYPE_LINUX_SLL2:
+            if len(frame) < 20:
+                return None
+            ether_type = ETHERTYPE.unpack_from(frame, 0)[0]
+            offset = 20
+        else:
+            raise UnsupportedCaptureException("Unsupported link type %d" % link_type)
+
+        if ether_type == ETHERTYPE_IPV4:
+            return PcapHelper.decode_ipv4(frame, offset)
+        if ether_type == ETHERTYPE_IPV6:
+            return PcapHelper.decode_ipv6(frame, offset)
+        return None
+
+    @staticmethod
+    def decode_ipv4(frame, offset):
+        if len(frame) < offset + 20:
+            return None
+        version_ihl, total_length, fragment, protocol = IPV4_HEADER.unpack_from(frame, offset)
+        if protocol != PROTOCOL_TCP or fragment & 0x3FFF:  # only unfragmented packets carry a full tcp header
+            return None
+        header_length = (version_ihl & 0x0F) * 4
+        end = min(len(frame), offset + total_length) if total_length else len(frame)
+        src = socket.inet_ntop(socket.AF_INET, bytes(frame[offset + 12:offset + 16]))
+        dst = socket.inet_ntop(socket.AF_INET, bytes(frame[offset + 16:offset + 20]))
+        return PcapHelper.decode_tcp(frame, offset + header_length, end, src, dst)
+
+    @staticmethod
+    def decode_ipv6(frame, offset):
+        if len(frame) < offset + 40:
+            return None
+        payload_length, next_header = IPV6_HEADER.unpack_from(frame, offset)
+        src = socket.inet_ntop(socket.AF_INET6, bytes(frame[offset + 8:offset + 24]))
+        dst = socket.inet_ntop(socket.AF_INET6, bytes(frame[offset + 24:offset + 40]))
+        end = min(len(frame), offset + 40 + payload_length)
+        offset += 40
+        while next_header in IPV6_EXTENSION_HEADERS and offset + 2 <= end:
+            next_header, length = frame[offset], frame[offset + 1]
+            offset += (length + 1) * 8
+        if next_header != PROTOCOL_TCP:
+            return None
+        return PcapHelper.decode_tcp(frame, offset, end, src, dst)
+
+    @staticmethod
+    def decode_tcp(frame, offset, end, src, dst):
+        if end < offset + 14:
+            return None
+        sport, dport, seq, data_offset = TCP_HEADER.unpack_from(frame, offset)
+        flags = TCP_FLAGS.unpack_from(frame, offset + 13)[0]
+        start = offset + (data_offset >> 4) * 4
+        return src, sport, dst, dport, seq, flags, frame[start:max(start, end)]
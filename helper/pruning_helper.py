@@ -1,10 +1,13 @@
+import os
+
 import mime_types.mime_types as mt
 from helper.utils import *
 from config import USE_ORACLE, CUSTOM_FILTER, CONFIGURATION
 
 
 class PruningHelper:
-    mime_types = mt.load("./mime_types")
+    # next to the module, so it loads from any working directory
+    mime_types = mt.load(os.path.dirname(mt.__file__))
 
     @staticmethod
     def get_prunable_codes_and_extenstions():
@@ -0,0 +1,58 @@
+import re
+
+
+class MultiReplacer:
+    """
+    Replaces all occurrences of many strings in a single pass, preferring the longest string at the leftmost
+    position, so the result doesn't depend on the order of the replacements.
+    The strings are compiled into a radix tree shaped regular expression: the regex engine follows the tree like an
+    Aho-Corasick automaton does, only the matched strings go back to Python.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = {old: new for old, new in replacements.items() if old}
+        if self.replacements:
+            self.pattern = re.compile(self.compile_node(self.build_tree(self.replacements)))
+        else:
+            self.pattern = None
+
+    @staticmethod
+    def build_tree(strings):
+        # a node is a dict from the first character of an edge to (edge label, child node), "" marks a string end
+        root = {}
+        for string in strings:
+            node = root
+            while True:
+                if not string:
+                    node[""] = None
+                    break
+                edge = node.get(string[0])
+                if edge is None:
+                    node[string[0]] = (string, {"": None})
+                    break
+                label, child = edge
+                common = 0
+                while common < min(len(label), len(string)) and label[common] == string[common]:
+                    common += 1
+                if common < len(label):
+                    # split the edge where the new string branches off
+                    child = {label[common]: (label[common:], child)}
+                    node[string[0]] = (label[:common], child)
+                node = child
+                string = string[common:]
+        return root
+
+    @staticmethod
+    def compile_node(node):
+        alternatives = [re.escape(label) + MultiReplacer.compile_node(child)
+                        for key, (label, child) in sorted((key, edge) for key, edge in node.items() if key)]
+        if not alternatives:
+            return ""
+        pattern = "(?:%s)" % "|".join(alternatives)
+        # a greedy optional group tries the longer strings first and falls back to the string ending here
+        return pattern + "?" if "" in node else pattern
+
+    def replace(self, string):
+        if self.pattern is None:
+            return string
+        return self.pattern.sub(lambda match: self.replacements[match.group(0)], string)
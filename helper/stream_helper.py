@@ -0,0 +1,386 @@
+import zlib
+from collections import deque
+
+from my_http.my_http import HTTPRequest, HTTPResponse, HTTPHelper
+
+FIN = 0x01
+SYN = 0x02
+RST = 0x04
+
+SEQ_MODULO = 1 << 32
+HEAD_SEPARATOR = HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR
+# longest header block we are willing to buffer before declaring a stream as non HTTP
+MAX_HEAD_LENGTH = 64 * 1024
+# out of order data we keep per direction before we assume the capture lost a segment
+MAX_OUT_OF_ORDER_LENGTH = 4 * 1024 * 1024
+HTTP_METHODS = {b"GET", b"POST", b"PUT", b"DELETE", b"HEAD", b"OPTIONS", b"PATCH", b"CONNECT", b"TRACE"}
+
+
+class HTTPMessageFramer:
+    """
+    Splits the reassembled byte stream of one direction of a TCP connection into complete HTTP/1.x messages.
+    The body length is determined by the Content-Length header, chunked transfer encoding or,
+    for responses without both, by the end of the connection.
+    Chunked bodies are decoded and the message head is rewritten to carry a Content-Length instead.
+    """
+
+    def __init__(self, is_request, body_expected=None):
+        self.is_request = is_request
+        # called with the parsed head of a response, returns False if the response can't have a body
+        self.body_expected = body_expected
+        self.buffer = bytearray()
+        self.head = None
+        self.head_lines = None
+        self.body = None
+        self.remaining = None
+        self.chunked = False
+        self.until_close = False
+        self.broken = False
+
+    def feed(self, data):
+        if self.broken:
+            return []
+        self.buffer += data
+        messages = []
+        while not self.broken:
+            message = self.next_message()
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    def finish(self):
+        # the connection got closed, responses without framing end here
+        if self.head is not None and self.until_close and not self.broken:
+            self.body += self.buffer
+            self.buffer = bytearray()
+            return [self.build_message()]
+        return []
+
+    def next_message(self):
+        if self.head is None and not self.parse_head():
+            return None
+
+        if self.chunked:
+            if not self.parse_chunks():
+                return None
+        elif self.until_close:
+            return None
+        else:
+            if len(self.buffer) < self.remaining:
+                return None
+            self.body += self.buffer[:self.remaining]
+            del self.buffer[:self.remaining]
+
+        return self.build_message()
+
+    def parse_head(self):
+        end = self.buffer.find(HEAD_SEPARATOR)
+        if end == -1:
+            if len(self.buffer) > MAX_HEAD_LENGTH:
+                self.broken = True
+            return False
+
+        head = bytes(self.buffer[:end])
+        del self.buffer[:end + len(HEAD_SEPARATOR)]
+        lines = head.split(HTTPHelper.SEPARATOR)
+        if not self.is_valid_start_line(lines[0]):
+            self.broken = True
+            return False
+
+        self.head = lines[0]
+        self.head_lines = []
+        self.body = bytearray()
+        self.remaining = 0
+        self.chunked = False
+        self.until_close = False
+
+        content_length = None
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip()
+            if name == b"transfer-encoding" and value.lower().endswith(b"chunked"):
+                self.chunked = True
+                continue
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+            self.head_lines.append(line)
+
+        if not self.is_request and self.body_expected is not None and not self.body_expected(self.head):
+            self.chunked = False
+            self.remaining = 0
+        elif self.chunked:
+            # the decoded body gets a new Content-Length once it is complete
+            self.head_lines = [line for line in self.head_lines if
+                               line.partition(b":")[0].strip().lower() != b"content-length"]
+            self.chunk_remaining = None
+        elif content_length is not None:
+            self.remaining = content_length
+        elif not self.is_request:
+            self.until_close = True
+        return True
+
+    def is_valid_start_line(self, line):
+        if self.is_request:
+            return line.split(b" ")[0] in HTTP_METHODS
+        return line.startswith(b"HTTP/")
+
+    def parse_chunks(self):
+        while True:
+            if self.chunk_remaining is None:
+                end = self.buffer.find(HTTPHelper.SEPARATOR)
+                if end == -1:
+                    return False
+                size_line = bytes(self.buffer[:end]).split(b";")[0].strip()
+                try:
+                    size = int(size_line, 16)
+                except ValueError:
+                    self.broken = True
+                    return False
+                del self.buffer[:end + len(HTTPHelper.SEPARATOR)]
+                if size == 0:
+                    self.chunk_remaining = -1
+                else:
+                    # chunk data is followed by a line break
+                    self.chunk_remaining = size + len(HTTPHelper.SEPARATOR)
+
+            if self.chunk_remaining == -1:
+                # skip the trailers until the final empty line
+                end = self.buffer.find(HTTPHelper.SEPARATOR)
+                if end == -1:
+                    return False
+                del self.buffer[:end + len(HTTPHelper.SEPARATOR)]
+                if end == 0:
+                    return True
+                continue
+
+            if len(self.buffer) < self.chunk_remaining:
+                return False
+            self.body += self.buffer[:self.chunk_remaining - len(HTTPHelper.SEPARATOR)]
+            del self.buffer[:self.chunk_remaining]
+            self.chunk_remaining = None
+
+    def build_message(self):
+        head_lines = self.head_lines
+        if self.chunked:
+            head_lines = head_lines + [b"Content-Length: %d" % len(self.body)]
+        message = HTTPHelper.SEPARATOR.join([self.head] + head_lines) + HEAD_SEPARATOR + bytes(self.body)
+        self.head = None
+        self.head_lines = None
+        self.body = None
+        return message
+
+
+class TCPDirection:
+    """
+    Reassembles the payload of one direction of a TCP connection from its segments in sequence number order.
+    """
+
+    def __init__(self):
+        self.next_seq = None
+        self.out_of_order = {}
+        self.out_of_order_length = 0
+        self.closed = False
+
+    def add_segment(self, seq, flags, payload):
+        if flags & SYN:
+            self.next_seq = (seq + 1) % SEQ_MODULO
+            seq = self.next_seq
+        if self.next_seq is None:
+            # the capture started in the middle of the connection
+            self.next_seq = seq
+
+        data = []
+        if len(payload) > 0:
+            offset = (seq - self.next_seq) % SEQ_MODULO
+            if offset >= SEQ_MODULO // 2:
+                # retransmission, only keep what we haven't seen yet
+                overlap = SEQ_MODULO - offset
+                if overlap < len(payload):
+                    data.append(bytes(payload[overlap:]))
+                    self.next_seq = (self.next_seq + len(payload) - overlap) % SEQ_MODULO
+            elif offset == 0:
+                data.append(bytes(payload))
+                self.next_seq = (self.next_seq + len(payload)) % SEQ_MODULO
+            elif seq not in self.out_of_order:
+                self.out_of_order[seq] = bytes(payload)
+                self.out_of_order_length += len(payload)
+
+            data += self.drain_out_of_order()
+
+        if flags & (FIN | RST):
+            self.closed = True
+        return data
+
+    def drain_out_of_order(self):
+        data = []
+        while self.out_of_order:
+            if self.next_seq in self.out_of_order:
+                payload = self.out_of_order.pop(self.next_seq)
+            elif self.out_of_order_length > MAX_OUT_OF_ORDER_LENGTH:
+                # a segment is missing from the capture, continue after the gap
+                self.next_seq = min(self.out_of_order, key=lambda s: (s - self.next_seq) % SEQ_MODULO)
+                payload = self.out_of_order.pop(self.next_seq)
+            else:
+                break
+            self.out_of_order_length -= len(payload)
+            data.append(payload)
+            self.next_seq = (self.next_seq + len(payload)) % SEQ_MODULO
+        return data
+
+
+class TCPFlow:
+    """
+    A bidirectional TCP connection. Requests are paired with the responses of the same connection in order.
+    """
+
+    def __init__(self, client, https):
+        self.client = client
+        self.https = https
+        self.directions = {True: TCPDirection(), False: TCPDirection()}
+        self.framers = {True: HTTPMessageFramer(True), False: HTTPMessageFramer(False, self.response_body_expected)}
+        self.pending_requests = deque()
+        # position of the segment that opened the flow in the capture
+        self.opened_at = 0
+
+    def response_body_expected(self, status_line):
+        parts = status_line.split(b" ")
+        status_code = parts[1] if len(parts) > 1 else b""
+        if status_code[:1] == b"1" or status_code in [b"204", b"304"]:
+            return False
+        if self.pending_requests and self.pending_requests[0].method == "HEAD":
+            return False
+        return True
+
+    def add_segment(self, from_client, seq, flags, payload):
+        pairs = []
+        direction = self.directions[from_client]
+        for data in direction.add_segment(seq, flags, payload):
+            pairs += self.handle_messages(from_client, self.framers[from_client].feed(data))
+        if direction.closed:
+            pairs += self.handle_messages(from_client, self.framers[from_client].finish())
+        return pairs
+
+    def finish(self):
+        pairs = []
+        for from_client in [True, False]:
+            pairs += self.handle_messages(from_client, self.framers[from_client].finish())
+        return pairs
+
+    @property
+    def closed(self):
+        return self.directions[True].closed and self.directions[False].closed
+
+    def handle_messages(self, from_client, messages):
+        pairs = []
+        for raw in messages:
+            try:
+                if from_client:
+                    self.pending_requests.append(HTTPRequest(raw_payload=raw, https=self.https))
+                    continue
+                response = HTTPResponse(raw_payload=raw)
+            except (UnicodeDecodeError, ValueError, IndexError):
+                if not from_client and self.pending_requests:
+                    self.pending_requests.popleft()
+                continue
+
+            if 100 <= response.status_code < 200:
+                # interim responses don't answer the request
+                continue
+            if self.pending_requests:
+                pairs.append((self.pending_requests.popleft(), response))
+        return pairs
+
+
+class StreamHelper:
+    @staticmethod
+    def flow_key(src, sport, dst, dport):
+        if (src, sport) <= (dst, dport):
+            return src, sport, dst, dport
+        return dst, dport, src, sport
+
+    @staticmethod
+    def flow_shard(key, shards):
+        # crc32 instead of hash, because str/bytes hashes differ between processes
+        return zlib.crc32(("%s|%d|%s|%d" % key).encode()) % shards
+
+    @staticmethod
+    def iter_http_pairs(segments):
+        """
+        Reassembles TCP segments (timestamp, src, sport, dst, dport, seq, flags, payload) into HTTP pairs.
+        Pairs are yielded as soon as the response is complete, only the open flows are kept in memory.
+        """
+        for _, request, response in StreamHelper.iter_positioned_http_pairs(enumerate(segments)):
+            yield request, response
+
+    @staticmethod
+    def iter_shard_batches(segments, shards, batch_size):
+        """
+        Splits the segments into shards by the hash of their flow while they are read, yields (shard, batch) with
+        batches of up to batch_size (position, segment) tuples. The payloads are copied, so the batches can be sent
+        to other processes. Besides the shard of every flow, only one unfinished batch per shard is kept.
+        """
+        batches = [[] for _ in range(shards)]
+        shard_of_flow = {}
+        for position, (timestamp, src, sport, dst, dport, seq, flags, payload) in enumerate(segments):
+            key = StreamHelper.flow_key(src, sport, dst, dport)
+            shard = shard_of_flow.get(key)
+            if shard is None:
+                shard = shard_of_flow[key] = StreamHelper.flow_shard(key, shards)
+            batch = batches[shard]
+            batch.append((position, (timestamp, src, sport, dst, dport, seq, flags, bytes(payload))))
+            if len(batch) >= batch_size:
+                yield shard, batch
+                batches[shard] = []
+        for shard, batch in enumerate(batches):
+            if batch:
+                yield shard, batch
+
+    @staticmethod
+    def iter_positioned_http_pairs(positioned_segments, end=None):
+        """
+        Like iter_http_pairs for (position, segment) tuples, but every pair comes with a sort key: the position of the
+        segment that completed it and the position of the segment that opened its flow. The flows still open at the end
+        are finished at position end (after the last segment by default), in the order they were opened.
+        The segments of a shard of the capture can be passed with their positions in the whole capture and an end
+        after all of them (e.g. infinity), the pairs of all shards can then be merged back into the order of a
+        sequential parse by their keys.
+        """
+        flows = {}
+        position = -1
+        for position, (_, src, sport, dst, dport, seq, flags, payload) in positioned_segments:
+            key = StreamHelper.flow_key(src, sport, dst, dport)
+            flow = flows.get(key)
+            if flow is None:
+                if flags & RST or (len(payload) == 0 and not flags & SYN):
+                    continue
+                if flags & SYN and flags & 0x10:  # SYN/ACK is sent by the server
+                    client = (dst, dport)
+                elif flags & SYN:
+                    client = (src, sport)
+                elif payload[:5] == b"HTTP/":
+                    client = (dst, dport)
+                else:
+                    client = (src, sport)
+                flow = TCPFlow(client, (dport if client == (src, sport) else sport) == 443)
+                flow.opened_at = position
+                flows[key] = flow
+
+            for request, response in flow.add_segment((src, sport) == flow.client, seq, flags, payload):
+                yield (position, flow.opened_at), request, response
+
+            if flow.closed or flags & RST:
+                for request, response in flow.finish():
+                    yield (position, flow.opened_at), request, response
+                del flows[key]
+
+        if end is None:
+            end = position + 1
+        # flows are kept in the order they were opened
+        for flow in flows.values():
+            for request, response in flow.finish():
+                yield (end, flow.opened_at), request, response
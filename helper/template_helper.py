@@ -0,0 +1,90 @@
+from bisect import bisect_left
+
+
+class RequestTemplate:
+    """
+    A request prepared for replaying it with new nonces: the positions of all occurrences of the old nonce forms
+    in its URL, headers and body are found once, a replay only splices in the new values.
+    """
+
+    def __init__(self, request, patterns):
+        self.url = request.url
+        self.headers = request.get_headers_for_replay()
+        self.content = request.content if isinstance(request.content, bytes) else request.content.encode()
+        self.url_occurrences = self.find_occurrences(self.url, patterns)
+        self.header_occurrences = {header: self.find_occurrences(value, patterns)
+                                   for header, value in self.headers.items()}
+        self.content_occurrences = self.find_occurrences(self.content, patterns, encode=True)
+
+    @staticmethod
+    def find_occurrences(text, patterns, encode=False):
+        # returns the occurrences ordered by position and whether any of them overlap
+        occurrences = []
+        for pattern in patterns:
+            needle = pattern.encode() if encode else pattern
+            start = text.find(needle)
+            while start != -1:
+                occurrences.append((start, start + len(needle), pattern))
+                start = text.find(needle, start + 1)
+        occurrences.sort()
+        overlapping = any(occurrences[i][1] > occurrences[i + 1][0] for i in range(len(occurrences) - 1))
+        return occurrences, overlapping
+
+    @staticmethod
+    def select(occurrences, real_nonces):
+        occurrences, overlapping = occurrences
+        if not overlapping:
+            return [occurrence for occurrence in occurrences if occurrence[2] in real_nonces]
+
+        # longer nonces win over the shorter ones they overlap with, just like replacing the longest ones first
+        selected = []
+        for start, end, pattern in sorted(occurrences, key=lambda occurrence: occurrence[0] - occurrence[1]):
+            if pattern not in real_nonces:
+                continue
+            index = bisect_left(selected, (start,))
+            if index > 0 and selected[index - 1][1] > start or index < len(selected) and selected[index][0] < end:
+                continue
+            selected.insert(index, (start, end, pattern))
+        return selected
+
+    def splice(self, text, occurrences, real_nonces, encode=False):
+        selected = self.select(occurrences, real_nonces)
+        if not selected:
+            return text
+        view = memoryview(text) if encode else text
+        parts = []
+        position = 0
+        for start, end, pattern in selected:
+            parts.append(view[position:start])
+            parts.append(real_nonces[pattern].encode() if encode else real_nonces[pattern])
+            position = end
+        parts.append(view[position:])
+        return (b"" if encode else "").join(parts)
+
+    def render(self, real_nonces):
+        url = self.splice(self.url, self.url_occurrences, real_nonces)
+        headers = {header: self.splice(value, self.header_occurrences[header], real_nonces)
+                   for header, value in self.headers.items()}
+        if real_nonces:
+            headers.pop("content-length", None)
+            headers.pop("date", None)
+        content = self.splice(self.content, self.content_occurrences, real_nonces, encode=True)
+        return url, headers, content
+
+
+class RequestTemplates:
+    """
+    The templates of all requests replayed with the nonces of one response nonce set,
+    compiled the first time a request is replayed and reused by every later replay.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.templates = {}
+
+    def render(self, request, real_nonces):
+        entry = self.templates.get(id(request))
+        if entry is None:
+            # the request is kept with its template, so its id can't be reused by another request
+            entry = self.templates[id(request)] = RequestTemplate(request, self.patterns), request
+        return entry[0].render(real_nonces)
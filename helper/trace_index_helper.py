@@ -0,0 +1,127 @@
+import mmap
+import pickle
+import struct
+
+from my_http.my_http import HTTPRequest, HTTPResponse
+from config import CONFIGURATION
+
+MAGIC = b"PROTEXIX"
+VERSION = 1
+# magic, version, pair count, index offset, index length, body segment offset
+FILE_HEADER = struct.Struct("<8sHxxIQQQ")
+
+
+class LazyBodyMixin:
+    """
+    Loads the body of a message from the memory mapped body segment on first access.
+    """
+    __slots__ = ()
+
+    def init_body(self, bodies, offset, length):
+        self.bodies = bodies
+        self.body_offset = offset
+        self.body_length = length
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = bytes(self.bodies[self.body_offset:self.body_offset + self.body_length])
+        return self._content
+
+    def get_content_length(self):
+        # known from the index, without loading the body
+        return self.body_length
+
+    def __getstate__(self):
+        # the memory map can't be pickled, so the body is loaded before
+        _, state = super().__getstate__()
+        state["_content"] = self.content
+        state["bodies"] = None
+        return None, state
+
+
+class IndexedHTTPRequest(LazyBodyMixin, HTTPRequest):
+    __slots__ = ("bodies", "body_offset", "body_length", "_content")
+
+    def __init__(self, record, bodies):
+        self.method, self.url, self.http_version, self.headers, offset, length = record
+        self.https = self.url[:5] == "https"
+        self.init_body(bodies, offset, length)
+
+
+class IndexedHTTPResponse(LazyBodyMixin, HTTPResponse):
+    __slots__ = ("bodies", "body_offset", "body_length", "_content")
+
+    def __init__(self, record, bodies):
+        self.status_code, self.status_text, self.http_version, self.headers, offset, length = record
+        self.init_body(bodies, offset, length)
+
+
+class TraceIndexHelper:
+    """
+    The indexed trace format consists of
+        - a fixed size file header
+        - the body segment with all request and response bodies one after another
+        - the header index, a pickled list with one record per pair containing method, URL, HTTP version and
+          headers (including the content-type) of both messages, the status and the offset and length of both bodies
+          inside the body segment
+    Opening a trace only reads the index, the bodies are read lazily from a memory map of the body segment.
+    """
+
+    @staticmethod
+    def is_index_file(file):
+        return file.endswith("ptx")
+
+    @staticmethod
+    def write_index_file(pairs, file):
+        index = []
+        with open(file, "wb") as output_file:
+            output_file.write(b"\0" * FILE_HEADER.size)
+            body_offset = output_file.tell()
+            position = 0
+
+            def write_body(content):
+                nonlocal position
+                if isinstance(content, str):
+                    content = content.encode()
+                output_file.write(content)
+                position += len(content)
+                return position - len(content), len(content)
+
+            for request, response in pairs:
+                request_body = write_body(request.content)
+                response_body = write_body(response.content)
+                index.append((
+                    (request.method, request.url, request.http_version, request.headers) + request_body,
+                    (response.status_code, response.status_text, response.http_version, response.headers) +
+                    response_body
+                ))
+
+            index_offset = output_file.tell()
+            index_bytes = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+            output_file.write(index_bytes)
+
+            output_file.seek(0)
+            output_file.write(FILE_HEADER.pack(MAGIC, VERSION, len(index), index_offset, len(index_bytes),
+                                               body_offset))
+
+    @staticmethod
+    def parse_index_file(file):
+        with open(file, "rb") as input_file:
+            magic, version, count, index_offset, index_length, body_offset = \
+                FILE_HEADER.unpack(input_file.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not an indexed trace file of version %d" % (file, VERSION))
+            input_file.seek(index_offset)
+            index = pickle.loads(input_file.read(index_length))
+            mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) if index_offset > body_offset \
+                else b""
+
+        bodies = memoryview(mapped)[body_offset:index_offset] if mapped else b""
+
+        if CONFIGURATION["DEBUG"]:
+            print("HTTP request/response count %d" % count)
+
+        return [(IndexedHTTPRequest(request, bodies), IndexedHTTPResponse(response, bodies))
+                for request, response in index]
@@ -0,0 +1,167 @@
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+from config import CONFIGURATION
+from helper.parsing_helper import ParsingHelper as pa
+from helper.json_helper import JSONHelper
+from helper.html_helper import HTMLHelper
+
+# rough memory use of a parsed body relative to the body size
+PARSED_SIZE_FACTORS = {"text": 1, "json": 4}
+MISSING = object()
+
+
+class ParsedBodyCache:
+    """
+    Keeps track of the memory the large parsed forms of all bodies (text, JSON documents) use and drops the
+    least recently used ones once they exceed BODY_VIEW_CACHE_SIZE bytes. They are parsed again on the next access.
+    The entries of collected views are dropped before the next addition.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # filled by the weakref callbacks, which can run in the middle of any allocation, even under the lock
+        self.collected = []
+
+    def touch(self, view, name):
+        with self.lock:
+            if (id(view), name) in self.entries:
+                self.entries.move_to_end((id(view), name))
+
+    def add(self, view, name, size):
+        key = (id(view), name)
+        with self.lock:
+            self.drop_collected()
+            # the entry of a collected view with the same id is replaced
+            _, replaced_size = self.entries.pop(key, (None, 0))
+            self.entries[key] = weakref.ref(view, lambda reference: self.collected.append((key, reference))), size
+            self.size += size - replaced_size
+            while self.size > self.max_size and len(self.entries) > 1:
+                (_, evicted_name), (evicted_reference, evicted_size) = self.entries.popitem(last=False)
+                evicted_view = evicted_reference()
+                if evicted_view is not None:
+                    evicted_view.values.pop(evicted_name, None)
+                self.size -= evicted_size
+
+    def drop_collected(self):
+        while self.collected:
+            key, reference = self.collected.pop()
+            entry = self.entries.get(key)
+            # unless the entry was evicted or replaced by a new view with the same id
+            if entry is not None and entry[0] is reference:
+                del self.entries[key]
+                self.size -= entry[1]
+
+
+parsed_body_cache = ParsedBodyCache(CONFIGURATION["BODY_VIEW_CACHE_SIZE"])
+
+
+class BodyView:
+    """
+    The parsed forms of the body of a message, each parsed at most once (as long as it isn't evicted):
+    the decoded text, the JSON document, the form parameters, the set-cookie map,
+    the meta refresh URL and the hidden inputs. Works for recorded messages and for httpx responses.
+    """
+
+    def __init__(self, content, content_type, set_cookie_headers):
+        self.content = content if isinstance(content, bytes) else content.encode()
+        self.content_type = content_type.split(";")[0].strip().lower()
+        self.set_cookie_headers = set_cookie_headers
+        self.values = {}
+
+    @staticmethod
+    def of(message):
+        view = getattr(message, "_body_view", None)
+        if view is None:
+            headers = message.headers
+            if hasattr(headers, "get_list"):  # httpx response
+                set_cookie_headers = headers.get_list("set-cookie")
+            else:
+                set_cookie_headers = headers.get("set-cookie", [])
+                if isinstance(set_cookie_headers, str):
+                    set_cookie_headers = [set_cookie_headers]
+            view = BodyView(message.content, headers.get("content-type", ""), set_cookie_headers)
+            message._body_view = view
+        return view
+
+    def memoized(self, name, parse, evictable=False):
+        value = self.values.get(name, MISSING)
+        if value is not MISSING:
+            if evictable:
+                parsed_body_cache.touch(self, name)
+            return value
+        value = parse()
+        self.values[name] = value
+        if evictable:
+            parsed_body_cache.add(self, name, len(self.content) * PARSED_SIZE_FACTORS[name])
+        return value
+
+    @property
+    def text(self):
+        return self.memoized("text", lambda: self.content.decode(errors="replace"), evictable=True)
+
+    @property
+    def json(self):
+        # the parsed JSON document, None if the body isn't JSON
+        def parse():
+            try:
+                return json.loads(JSONHelper.strip_prefix(self.text))
+            except ValueError:
+                return None
+        return self.memoized("json", parse, evictable=True)
+
+    def json_leaf(self, path):
+        """
+        The leaf at the path string (like "|data|0|token") of the JSON body, None if there is none.
+        Unless the body is parsed already only the leaf is decoded while scanning the body.
+        """
+        if "json" in self.values:
+            return JSONHelper.lookup(self.values["json"], path)
+        try:
+            return JSONHelper.extract(self.text, path)
+        except ValueError:
+            return None
+
+    @property
+    def form_params(self):
+        def parse():
+            params = {}
+            for param in self.text.split("&"):
+                key, _, value = param.partition("=")
+                params[key] = value
+            return params
+        return self.memoized("form_params", parse)
+
+    @property
+    def set_cookies(self):
+        def parse():
+            cookies = {}
+            for set_cookie in self.set_cookie_headers:
+                key, value = pa.parse_set_cookie_header(set_cookie)
+                cookies[key] = value
+            return cookies
+        return self.memoized("set_cookies", parse)
+
+    @property
+    def nonce_markers(self):
+        # the attributes of the first meta refresh element and the hidden inputs, without building a DOM
+        return self.memoized("nonce_markers", lambda: HTMLHelper.extract_nonce_markers(self.content))
+
+    @property
+    def meta_refresh_url(self):
+        meta_refresh = self.nonce_markers[0]
+        if meta_refresh is None:
+            return None
+        if meta_refresh.get("data-url"):
+            return meta_refresh.get("data-url")
+        return (meta_refresh.get("content") or "").split(";url=")[-1]
+
+    @property
+    def hidden_inputs(self):
+        # map from a path identifying each hidden input to its value
+        return self.nonce_markers[1]
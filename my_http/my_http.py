@@ -1,3 +1,4 @@
+from abc import ABC, abstractmethod
 from urllib.parse import urlparse
 import json
 
@@ -33,27 +34,61 @@ class HTTPHelper:
         return header_str
 
 
-class HTTPRequest:
+class HTTPMessage(ABC):
+    """
+    Base of requests and responses. The hash of a message is computed once, so messages must not be changed after
+    they were hashed (e.g. put into a set). The parsed views of the URL, the query and the cookies are created on
+    first access.
+    """
+    __slots__ = ("content", "headers", "http_version", "_hash", "_body_view")
+
+    @abstractmethod
+    def key(self):
+        # the fields that make up the identity of the message
+        pass
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(self.key())
+            return self._hash
+
+    def __eq__(self, obj):
+        return self is obj or hash(self) == hash(obj)
+
+    def __getstate__(self):
+        # the hash of strings differs between processes and the body view is parsed again when needed
+        state = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if name not in ["_hash", "_body_view"]:
+                    try:
+                        state[name] = cls.__dict__[name].__get__(self)  # the slot itself, not a property over it
+                    except AttributeError:
+                        pass
+        return None, state
+
+    def get_content_length(self):
+        return len(self.content)
+
+
+class HTTPRequest(HTTPMessage):
+    __slots__ = ("method", "url", "https", "_url_parsed", "_query_params", "_cookies")
+
     def __init__(self, request_dict=None, raw_payload=None, https=True):
         if request_dict:
             self.content = request_dict["content"]
             self.method = request_dict["method"].decode()
             self.url = request_dict["url"]
-            self.url_parsed = urlparse(self.url)
             self.http_version = request_dict["http_version"].decode()
             self.https = self.url[:5] == "https"
             self.headers = {key: request_dict["headers"][key] for key in request_dict["headers"]}
         elif not request_dict and raw_payload:
-            self.raw_payload = raw_payload
-            self.content = ""
-            self.method = ""
-            self.path = ""
-            self.http_version = ""
             self.https = https
 
-            request_parts = raw_payload.split(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
-            header = request_parts[0]
-            self.content = (HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR).join(request_parts[1:])
+            # the raw payload isn't kept, only its parts
+            header, _, self.content = raw_payload.partition(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
 
             headers = header.split(HTTPHelper.SEPARATOR)
             info_parts = headers[0].split(b" ")
@@ -74,7 +109,14 @@ class HTTPRequest:
                 protocol = "http://"
 
             self.url = protocol + host + url_rest
-            self.url_parsed = urlparse(self.url)
+
+    @property
+    def url_parsed(self):
+        try:
+            return self._url_parsed
+        except AttributeError:
+            self._url_parsed = urlparse(self.url)
+            return self._url_parsed
 
     def get_headers_for_replay(self):
         headers_for_replay = self.headers.copy()
@@ -90,15 +132,25 @@ class HTTPRequest:
         return parts
 
     def get_url_query_params(self):
+        # shared between all callers, must not be changed
+        try:
+            return self._query_params
+        except AttributeError:
+            pass
         params = {}
         if self.url_parsed.query != "":
             for part in self.url_parsed.query.split("&"):
                 parts = part.split("=")
                 params[parts[0]] = "" if len(parts) == 1 else parts[1]
-
+        self._query_params = params
         return params
 
     def get_cookies_pairs(self):
+        # shared between all callers, must not be changed
+        try:
+            return self._cookies
+        except AttributeError:
+            pass
         cookies = {}
         if "cookie" in self.headers:
             for cookie in self.headers["cookie"].split("; "):
@@ -107,6 +159,7 @@ class HTTPRequest:
                 # base64 encoded string have more parts
                 value = "=".join(split[1:])
                 cookies[key] = value
+        self._cookies = cookies
         return cookies
 
     def __str__(self):
@@ -115,17 +168,13 @@ class HTTPRequest:
         content = self.content
         return "HTTP-Request: (HTTP{})\nInfo:\n{}Headers:\n{}\nContent:\n{}\n".format("S" if self.https else "", info, header_str, content)
 
-    def __key(self):
+    def key(self):
         return self.content, self.method, self.url, self.http_version, str(self.headers)
 
-    def __hash__(self):
-        return hash(self.__key())
-
-    def __eq__(self, obj):
-        return hash(self) == hash(obj)
 
+class HTTPResponse(HTTPMessage):
+    __slots__ = ("status_code", "status_text")
 
-class HTTPResponse:
     def __init__(self, response_dict=None, raw_payload=None):
         if response_dict:
             self.headers = {key: response_dict["headers"][key] for key in response_dict["headers"] if key != "set-cookie"}
@@ -136,16 +185,10 @@ class HTTPResponse:
             self.status_text = response_dict["reason"].decode()
             self.http_version = response_dict["http_version"].decode()
         elif raw_payload:
-            self.raw_payload = raw_payload
-            self.headers = {}
-            self.content = ""
-            self.status_code = ""
             self.status_text = ""
-            self.http_version = ""
 
-            request_parts = raw_payload.split(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
-            header = request_parts[0]
-            self.content = (HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR).join(request_parts[1:])
+            # the raw payload isn't kept, only its parts
+            header, _, self.content = raw_payload.partition(HTTPHelper.SEPARATOR + HTTPHelper.SEPARATOR)
 
             headers = header.split(HTTPHelper.SEPARATOR)
             info_parts = headers[0].split(b" ")
@@ -185,15 +228,9 @@ class HTTPResponse:
             data[key] = value
         return data
 
-    def __key(self):
+    def key(self):
         return self.status_code, self.http_version, str(self.headers), self.content
 
-    def __hash__(self):
-        return hash(self.__key())
-
-    def __eq__(self, obj):
-        return hash(self) == hash(obj)
-
     def __str__(self):
         info = "\tHTTP-Version: {}\n\tStatus Code: {}\n\tStatus Text: {}\n".format(self.http_version, self.status_code, self.status_text)
         header_str = HTTPHelper.headers_to_str(self.headers)
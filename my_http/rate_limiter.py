@@ -0,0 +1,92 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# responses telling us to slow down
+THROTTLING_STATUS_CODES = [429, 503]
+# methods that can be sent again without changing the outcome, others might have been processed by a 503 answer
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # a negative amount of tokens are the requests already waiting for one
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+
+class RateLimiter:
+    """
+    Throttles the replayed requests with one token bucket per origin. The rate of an origin grows additively
+    while its responses are fine and is cut multiplicatively as soon as it answers with 429 or 503,
+    a Retry-After header blocks the origin for the given time. Throttled requests are only retried if that can't
+    repeat a side effect, i.e. idempotent ones or those rejected with 429 or a Retry-After header.
+    The limiter is thread safe, reserve only returns the delay, so it can be waited for with time or asyncio.
+    """
+
+    def __init__(self, config):
+        self.enabled = config["ENABLED"]
+        self.initial_rate = config["INITIAL_RATE"]
+        self.min_rate = config["MIN_RATE"]
+        self.max_rate = config["MAX_RATE"]
+        self.burst = config["BURST"]
+        self.additive_increase = config["ADDITIVE_INCREASE"]
+        self.multiplicative_decrease = config["MULTIPLICATIVE_DECREASE"]
+        self.max_retries = config["MAX_RETRIES"] if self.enabled else 0
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, origin):
+        if origin not in self.buckets:
+            self.buckets[origin] = TokenBucket(self.initial_rate, self.burst)
+        return self.buckets[origin]
+
+    def reserve(self, origin):
+        if not self.enabled:
+            return 0.0
+        with self.lock:
+            return self.get_bucket(origin).reserve(time.monotonic())
+
+    def update(self, origin, response):
+        if not self.enabled:
+            return
+        with self.lock:
+            bucket = self.get_bucket(origin)
+            if response.status_code in THROTTLING_STATUS_CODES:
+                bucket.rate = max(self.min_rate, bucket.rate * self.multiplicative_decrease)
+                bucket.tokens = min(bucket.tokens, 0.0)
+                retry_after = self.parse_retry_after(response.headers.get("retry-after"))
+                if retry_after is not None:
+                    bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            else:
+                # increase by additive_increase requests per second for every second of requests
+                bucket.rate = min(self.max_rate, bucket.rate + self.additive_increase / bucket.rate)
+
+    def should_retry(self, method, response):
+        if not self.enabled or response.status_code not in THROTTLING_STATUS_CODES:
+            return False
+        # a 429 or a Retry-After header means the request was rejected before it was processed
+        return method.upper() in IDEMPOTENT_METHODS or response.status_code == 429 \
+            or "retry-after" in response.headers
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
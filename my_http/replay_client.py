@@ -0,0 +1,211 @@
+import asyncio
+import time
+from http.cookiejar import Cookie, CookieJar, DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import httpx
+
+from config import CONFIGURATION
+from my_http.rate_limiter import RateLimiter
+
+try:
+    import h2  # noqa: F401, only needed for HTTP/2 support in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+shared_rate_limiter = None
+
+
+def get_shared_rate_limiter():
+    # one limiter for all replays, so what it learned about an origin carries over to the next replay
+    global shared_rate_limiter
+    if shared_rate_limiter is None:
+        shared_rate_limiter = RateLimiter(CONFIGURATION["RATE_LIMIT"])
+    return shared_rate_limiter
+
+
+class ReplayClient:
+    """
+    Sends the requests of one replay over persistent (keep-alive, optionally HTTP/2 multiplexed) connections.
+    Cookies are never stored by the client, the replayed requests carry the recorded cookies themselves.
+    The timing of every request is collected in timings as dict with
+    connect (TCP connect), tls (TLS handshake), ttfb (time to first byte) and total seconds.
+    All requests pass the shared per origin rate limiter, throttled requests are retried once it allows it.
+    """
+    client_class = httpx.Client
+
+    def __init__(self):
+        config = CONFIGURATION["REPLAY_CLIENT"]
+        self.http2 = config["HTTP2"] and HTTP2_AVAILABLE
+        self.limits = httpx.Limits(max_connections=config["MAX_CONNECTIONS"],
+                                   max_keepalive_connections=config["MAX_KEEPALIVE_CONNECTIONS"],
+                                   keepalive_expiry=config["KEEPALIVE_EXPIRY"])
+        self.timeout = httpx.Timeout(config["TIMEOUT"], connect=config["CONNECT_TIMEOUT"])
+        self.per_origin = config["PER_ORIGIN_POOLS"]
+        self.max_redirects = config["MAX_REDIRECTS"]
+        self.rate_limiter = get_shared_rate_limiter()
+        self.clients = {}
+        self.timings = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.clients = {}
+
+    @staticmethod
+    def get_origin(url):
+        parsed = urlparse(url)
+        return parsed.scheme + "://" + parsed.netloc
+
+    def get_client(self, url):
+        origin = self.get_origin(url) if self.per_origin else None
+        if origin not in self.clients:
+            self.clients[origin] = self.client_class(http2=self.http2, limits=self.limits, timeout=self.timeout,
+                                                     cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])))
+        return self.clients[origin]
+
+    @staticmethod
+    def prepare_headers(headers):
+        # pseudo headers of recorded HTTP/2 requests are set by the transport
+        return {key: value for key, value in (headers or {}).items() if not key.startswith(":")}
+
+    def request(self, method, url, content=None, headers=None, follow_redirects=False):
+        origin = self.get_origin(url)
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            time.sleep(self.rate_limiter.reserve(origin))
+            timing, trace = self.start_timing(url)
+            response = self.get_client(url).request(method, url, content=content,
+                                                    headers=self.prepare_headers(headers),
+                                                    follow_redirects=follow_redirects, extensions={"trace": trace})
+            self.finish_timing(timing)
+            self.rate_limiter.update(origin, response)
+            if not self.rate_limiter.should_retry(method, response):
+                break
+        return response
+
+    def follow_redirects(self, response, headers):
+        """
+        Follows the redirects of a response sent without following them, returns the responses of all hops
+        starting with the given one. Unlike the redirects of httpx every hop carries the replayed cookies of its
+        host, updated by the cookies the previous hops set for it.
+        """
+        chain = [response]
+        while chain[-1].next_request is not None and len(chain) <= self.max_redirects:
+            chain.append(self.request(*self.redirect_request(chain, headers)))
+        return chain
+
+    @staticmethod
+    def redirect_request(chain, headers):
+        next_request = chain[-1].next_request
+        # cookies without a Domain attribute only go back to the host that set them
+        cookies = httpx.Cookies(CookieJar(policy=DefaultCookiePolicy(
+            strict_ns_domain=DefaultCookiePolicy.DomainStrictNonDomain)))
+        # the replayed cookies were sent to the host of the first request, as if it had set them
+        host = chain[0].request.url.host
+        for key, value in (headers or {}).items():
+            if key.lower() == "cookie":
+                for cookie in value.split(";"):
+                    name, _, cookie_value = cookie.strip().partition("=")
+                    cookies.jar.set_cookie(Cookie(
+                        version=0, name=name, value=cookie_value, port=None, port_specified=False, domain=host,
+                        domain_specified=False, domain_initial_dot=False, path="/", path_specified=False,
+                        secure=False, expires=None, discard=True, comment=None, comment_url=None, rest={}))
+        for response in chain:
+            cookies.extract_cookies(response)
+
+        # httpx already adjusted method, host, authorization and body to the redirect and dropped the cookie header
+        redirect_headers = {key: value for key, value in next_request.headers.items()
+                            if key.lower() not in ["content-length", "transfer-encoding"]}
+        cookie_request = httpx.Request(next_request.method, next_request.url)
+        cookies.set_cookie_header(cookie_request)
+        if "cookie" in cookie_request.headers:
+            redirect_headers["cookie"] = cookie_request.headers["cookie"]
+        return next_request.method, str(next_request.url), next_request.read() or None, redirect_headers
+
+    def start_timing(self, url):
+        timing = {"url": url, "connect": 0.0, "tls": 0.0, "ttfb": None, "total": None, "start": time.perf_counter()}
+        started = {}
+
+        def trace(event, info):
+            name, _, phase = event.rpartition(".")
+            now = time.perf_counter()
+            if phase == "started":
+                started[name] = now
+            elif phase == "complete" and name in started:
+                if name == "connection.connect_tcp":
+                    timing["connect"] += now - started[name]
+                elif name == "connection.start_tls":
+                    timing["tls"] += now - started[name]
+                elif name.endswith("receive_response_headers") and timing["ttfb"] is None:
+                    timing["ttfb"] = now - timing["start"]
+
+        return timing, trace
+
+    def finish_timing(self, timing):
+        timing["total"] = time.perf_counter() - timing["start"]
+        self.timings.append(timing)
+
+    @staticmethod
+    def format_timing(timing):
+        return "connect %.0f ms, tls %.0f ms, ttfb %.0f ms, total %.0f ms" % (
+            timing["connect"] * 1000, timing["tls"] * 1000, (timing["ttfb"] or 0) * 1000, timing["total"] * 1000)
+
+
+class AsyncReplayClient(ReplayClient):
+    """
+    The asyncio counterpart of ReplayClient for concurrent replays,
+    at most MAX_CONCURRENCY_PER_ORIGIN requests are in flight per origin.
+    """
+    client_class = httpx.AsyncClient
+
+    def __init__(self):
+        super().__init__()
+        self.max_concurrency = CONFIGURATION["REPLAY_CLIENT"]["MAX_CONCURRENCY_PER_ORIGIN"]
+        self.semaphores = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients = {}
+
+    async def follow_redirects(self, response, headers):
+        chain = [response]
+        while chain[-1].next_request is not None and len(chain) <= self.max_redirects:
+            chain.append(await self.request(*self.redirect_request(chain, headers)))
+        return chain
+
+    async def request(self, method, url, content=None, headers=None, follow_redirects=False):
+        origin = self.get_origin(url)
+        if origin not in self.semaphores:
+            self.semaphores[origin] = asyncio.Semaphore(self.max_concurrency)
+
+        async with self.semaphores[origin]:
+            for attempt in range(self.rate_limiter.max_retries + 1):
+                await asyncio.sleep(self.rate_limiter.reserve(origin))
+                timing, trace = self.start_timing(url)
+
+                async def async_trace(event, info):
+                    trace(event, info)
+
+                response = await self.get_client(url).request(method, url, content=content,
+                                                              headers=self.prepare_headers(headers),
+                                                              follow_redirects=follow_redirects,
+                                                              extensions={"trace": async_trace})
+                self.finish_timing(timing)
+                self.rate_limiter.update(origin, response)
+                if not self.rate_limiter.should_retry(method, response):
+                    break
+        return response
@@ -0,0 +1,78 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+import pickle
+
+import httpx
+from lxml import etree
+
+from my_http.my_http import HTTPResponse
+from my_http.body_view import BodyView, ParsedBodyCache
+from helper.html_helper import HTMLHelper
+from helper.nonces_helper import NoncesHelper
+import tool
+
+
+class TestBodyView(unittest.TestCase):
+    html = b'<html><head><meta http-equiv="refresh" content="0;url=/next?state=%s"></head>' \
+           b'<body><input type="hidden" id="csrf" value="%s"></body></html>'
+
+    def html_response(self, value):
+        return HTTPResponse(raw_payload=b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n" +
+                            self.html % (value, value[::-1]))
+
+    def test_detection_and_retrieval_share_one_parse(self):
+        response1, response2 = self.html_response(b"aaaa1111"), self.html_response(b"bbbb2222")
+        response_nonces = set()
+        NoncesHelper.find_nonces_in_responses(response1, response2, set(), response_nonces)
+        self.assertEqual({("aaaa1111", "meta-redirect-query", "state"), ("1111aaaa", "html-hidden-input",
+                                                                         "//input[@id='csrf']")},
+                         {nonce[1:] for nonce in response_nonces})
+        markers = BodyView.of(response1).nonce_markers
+        self.assertEqual("1111aaaa", tool.extract_nonce(response1, "html-hidden-input", "//input[@id='csrf']"))
+        self.assertIs(markers, BodyView.of(response1).nonce_markers)
+
+        replayed = httpx.Response(200, headers=[("content-type", "application/json"), ("set-cookie", "a=1; Path=/"),
+                                                ("set-cookie", "b=2")], content=b'{"x": [{"y": 3}]}')
+        self.assertEqual("3", tool.extract_nonce(replayed, "json", "|x|0|y"))
+        self.assertEqual("2", tool.extract_nonce(replayed, "set-cookie", "b"))
+
+    def test_streamed_paths_match_the_dom(self):
+        content = b'<p>a<b><input type="hidden" value="1"></b><b>b</b><p><input type="hidden" value="2">' \
+                  b'<div><input type=hidden value="3"><input type="hidden" value="4"></div>'
+        dom = etree.HTML(content)
+        expected = {dom.getroottree().getpath(element): element.get("value")
+                    for element in dom.xpath("//input[@type='hidden']")}
+        self.assertEqual((None, expected), HTMLHelper.extract_nonce_markers(content))
+        duplicates = b'<input type="hidden" id="csrf" value="1"><input type="hidden" id="csrf" value="2">'
+        self.assertEqual((None, {"//input[@id='csrf']": "1"}), HTMLHelper.extract_nonce_markers(duplicates))
+        self.assertEqual((None, {}), HTMLHelper.extract_nonce_markers(b"<html><body>" + b"<p>x</p>" * 1000))
+
+    def test_eviction_and_pickling(self):
+        cache = ParsedBodyCache(100)
+        views = [BodyView(b"x" * 40, "text/plain", []) for _ in range(3)]
+        for view in views:
+            view.values["text"] = view.content.decode()
+            cache.add(view, "text", len(view.content))
+        self.assertNotIn("text", views[0].values)
+        self.assertIn("text", views[2].values)
+        self.assertEqual(80, cache.size)
+
+        # collected views give their size back
+        del views[2], view
+        small = BodyView(b"x" * 10, "text/plain", [])
+        cache.add(small, "text", len(small.content))
+        self.assertEqual(50, cache.size)
+        self.assertEqual(2, len(cache.entries))
+
+        response = self.html_response(b"aaaa1111")
+        BodyView.of(response).nonce_markers
+        restored = pickle.loads(pickle.dumps(response))
+        self.assertEqual("/next?state=aaaa1111", BodyView.of(restored).meta_refresh_url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import sys
+
+sys.path.append('../')
+
+import os
+import tempfile
+import unittest
+
+from helper.journal_helper import ReplayJournal
+
+
+class TestReplayJournal(unittest.TestCase):
+
+    def test_runs_without_resume_keep_the_interrupted_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "journal.jsonl")
+            journal = ReplayJournal(file)
+            journal.record("matching", [[0, 0]], verdict=False)
+            journal.close()
+            with open(file, "a") as opened_file:
+                opened_file.write('{"kind": "pruning", "key": [1')
+
+            journal = ReplayJournal(file, resume=True)
+            self.assertEqual(False, journal.lookup("matching", [[0, 0]])["verdict"])
+            journal.record("pruning", [2, 1, [0]], verdict=True)
+            journal.close()
+
+            journal = ReplayJournal(file)
+            self.assertIsNone(journal.lookup("matching", [[0, 0]]))
+            journal.close()
+            with open(file) as opened_file:
+                self.assertEqual(6, len(opened_file.readlines()))
+
+            journal = ReplayJournal(file, resume=True)
+            self.assertIsNone(journal.lookup("pruning", [2, 1, [0]]))
+            journal.close()
+
+    def test_entries_of_other_inputs_are_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "journal.jsonl")
+            journal = ReplayJournal(file, identity={"inputs": "a", "oracle": "x"})
+            journal.record("matching", [[0, 0]], verdict=True)
+            journal.close()
+
+            journal = ReplayJournal(file, resume=True, identity={"inputs": "a", "oracle": "y"})
+            self.assertIsNone(journal.lookup("matching", [[0, 0]]))
+            self.assertEqual(1, journal.ignored)
+            journal.close()
+
+            journal = ReplayJournal(file, resume=True, identity={"inputs": "a", "oracle": "x"})
+            self.assertEqual(True, journal.lookup("matching", [[0, 0]])["verdict"])
+            journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+import json
+
+from helper.json_helper import JSONHelper
+from helper.parsing_helper import ParsingHelper as pa
+
+
+class TestJSONHelper(unittest.TestCase):
+    document1 = {"data": {"items": [{"id": 1, "token": "abc"}, {"id": 2, "token": "a]\\\"}"}], "same": {"x": [1, 2]}},
+                 "moved": {"0": "a"}, "csrf": "t1"}
+    document2 = {"data": {"items": [{"id": 1, "token": "abd"}], "same": {"x": [1, 2]}}, "moved": ["b"], "csrf": "t2"}
+
+    def test_diff_matches_flattened_maps(self):
+        map1 = dict(pa.flatten_json(self.document1))
+        map2 = dict(pa.flatten_json(self.document2))
+        expected = {(key, map1[key], map2[key]) for key in map1 if key in map2 and map1[key] != map2[key]}
+        self.assertEqual(expected, {(JSONHelper.path_string(path), value1, value2)
+                                    for path, value1, value2 in JSONHelper.diff(self.document1, self.document2)})
+        self.assertEqual(["|data|items|0|id", "|data|items|0|token"], list(map1)[:2])
+
+    def test_streaming_extraction(self):
+        content = ")]}'\n" + json.dumps(self.document1, indent=1)
+        for path, value in pa.flatten_json(self.document1):
+            self.assertEqual(value, JSONHelper.extract(content, path))
+        self.assertIsNone(JSONHelper.extract(content, "|data|items"))
+        self.assertIsNone(JSONHelper.extract(content, "|data|items|2|id"))
+        self.assertIsNone(JSONHelper.extract(content, "|missing"))
+        self.assertRaises(ValueError, JSONHelper.extract, '{"a": [1, "]"', "|b")
+
+    def test_duplicated_keys_extract_the_last_member(self):
+        content = '{"token": "first", "nested": {"id": 1, "id": 2}, "token": "last"}'
+        document = json.loads(content)
+        for path in ["|token", "|nested|id"]:
+            self.assertEqual(JSONHelper.lookup(document, path), JSONHelper.extract(content, path))
+        self.assertEqual("last", JSONHelper.extract(content, "|token"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,13 @@ import sys
 
 sys.path.append('../')
 
+import os
+import tempfile
 import unittest
 
 from my_http.my_http import *
 from helper.matching_helper import MatchingHelper as ma
+from helper.trace_index_helper import TraceIndexHelper
 
 
 def create_http_pair_with_url(url):
@@ -46,14 +49,37 @@ def print_matchings(matchings):
         i += 1
 
 
+def matching_to_indices(matching, trace1, trace2):
+    return tuple((trace1.index(pair1), trace2.index(pair2)) for pair1, pair2 in matching)
+
+
+def is_sub_matching(matching, other):
+    return matching != other and set(matching) <= set(other)
+
+
 class TestComplexMatch(unittest.TestCase):
 
+    def assert_dp_matches_maximal_z3(self, trace1, trace2, nogoods=frozenset()):
+        z3_matchings = [matching_to_indices(matching, trace1, trace2)
+                        for matching in ma.match_two_traces(trace1, trace2, backend="z3", nogoods=nogoods)]
+        maximal = {matching for matching in z3_matchings
+                   if not any(is_sub_matching(matching, other) for other in z3_matchings)}
+
+        dp_matchings = [matching_to_indices(matching, trace1, trace2)
+                        for matching in ma.match_two_traces(trace1, trace2, backend="dp", nogoods=nogoods)]
+
+        self.assertEqual(len(dp_matchings), len(set(dp_matchings)))
+        self.assertEqual(set(dp_matchings), maximal)
+        lengths = [len(matching) for matching in dp_matchings]
+        self.assertEqual(lengths, sorted(lengths, reverse=True))
+
     def test_trivial_count(self):
         trace1 = [create_http_pair_with_url("http://a.com/")]
         trace2 = [create_http_pair_with_url("http://a.com/")]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
         self.assertEqual(len(matchings), 1)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_simple_count(self):
         trace1 = [
@@ -65,8 +91,9 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://b.com/"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
         self.assertEqual(len(matchings), 3)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_swap_count(self):
         trace1 = [
@@ -78,8 +105,9 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://b.com/"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
         self.assertEqual(len(matchings), 2)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_medium_count(self):
         trace1 = [
@@ -95,9 +123,10 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://c.com/"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
 
         self.assertEqual(len(matchings), 11)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_simple_multiple_possibilities_count(self):
         trace1 = [
@@ -111,9 +140,10 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://b.com/"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
 
         self.assertEqual(len(matchings), 11)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_multiple_possibilities_count(self):
         trace1 = [
@@ -129,9 +159,10 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://b.com/b"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
 
         self.assertEqual(len(matchings), 35)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_more_multiple_possibilities_count(self):
         trace1 = [
@@ -151,9 +182,10 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://c.com/b"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
 
         self.assertEqual(len(matchings), 215)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
 
     def test_chaotic_count(self):
         trace1 = [
@@ -172,9 +204,101 @@ class TestComplexMatch(unittest.TestCase):
             create_http_pair_with_url("http://c.com/b"),
         ]
 
-        matchings = list(ma.match_two_traces(trace1, trace2))
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="z3"))
 
         self.assertEqual(len(matchings), 39)
+        self.assert_dp_matches_maximal_z3(trace1, trace2)
+
+    def test_ranked_order(self):
+        trace1 = [
+            create_http_pair_with_url("http://a.com/1?x=1"),
+            create_http_pair_with_url("http://b.com/"),
+        ]
+        trace2 = [
+            create_http_pair_with_url("http://a.com/2?y=1"),
+            create_http_pair_with_url("http://a.com/1?x=2"),
+            create_http_pair_with_url("http://b.com/"),
+        ]
+
+        matchings = list(ma.match_two_traces(trace1, trace2, backend="dp", ranked=True))
+
+        self.assertEqual([matching_to_indices(matching, trace1, trace2) for matching in matchings],
+                         [((0, 1), (1, 2)), ((0, 0), (1, 2))])
+        self.assertGreater(matchings[0].score, matchings[1].score)
+
+    def test_ranking_keeps_indexed_bodies_unloaded(self):
+        pairs = [create_http_pair_with_url("http://a.com/1?x=1"), create_http_pair_with_url("http://a.com/2?y=1")]
+        pairs[0][1].content = b'{"a": 1}'
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "trace.ptx")
+            TraceIndexHelper.write_index_file(pairs, file)
+            trace = TraceIndexHelper.parse_index_file(file)
+
+            matchings = list(ma.match_two_traces(trace, trace, backend="dp", ranked=True))
+
+            self.assertTrue(all(message._content is None for pair in trace for message in pair))
+            self.assertEqual(matching_to_indices(matchings[0], trace, trace), ((0, 0), (1, 1)))
+
+    def test_nogoods(self):
+        trace1 = [
+            create_http_pair_with_url("http://a.com/1"),
+            create_http_pair_with_url("http://a.com/2"),
+        ]
+        trace2 = [
+            create_http_pair_with_url("http://a.com/a"),
+            create_http_pair_with_url("http://a.com/b"),
+        ]
+
+        for backend in ["dp", "z3"]:
+            nogoods = set()
+            seen = []
+            for matching in ma.match_two_traces(trace1, trace2, backend=backend, nogoods=nogoods):
+                indices = matching_to_indices(matching, trace1, trace2)
+                self.assertFalse(any(pair in nogoods for pair in indices))
+                seen.append(indices)
+                nogoods.add(indices[0])
+            self.assertEqual(len(seen), len(set(seen)))
+            self.assertGreater(len(seen), 1)
+
+    def test_nogoods_maximality(self):
+        trace = [
+            create_http_pair_with_url("http://a.com/x~y"),
+            create_http_pair_with_url("http://b.com/"),
+            create_http_pair_with_url("http://c.com/"),
+        ]
+
+        self.assertEqual([matching_to_indices(matching, trace, trace)
+                          for matching in ma.match_two_traces(trace, trace, backend="dp", nogoods={(1, 1)})],
+                         [((0, 0), (2, 2))])
+        self.assert_dp_matches_maximal_z3(trace, trace, frozenset({(1, 1)}))
+
+        trace1 = [
+            create_http_pair_with_url("http://a.com/1"),
+            create_http_pair_with_url("http://a.com/2"),
+            create_http_pair_with_url("http://b.com/"),
+            create_http_pair_with_url("http://a.com/3"),
+        ]
+        trace2 = [
+            create_http_pair_with_url("http://a.com/a"),
+            create_http_pair_with_url("http://b.com/"),
+            create_http_pair_with_url("http://a.com/b"),
+            create_http_pair_with_url("http://a.com/c"),
+        ]
+        self.assert_dp_matches_maximal_z3(trace1, trace2, frozenset({(0, 0), (2, 1), (3, 3)}))
+
+    def test_learned_nogoods_maximality(self):
+        trace = [
+            create_http_pair_with_url("http://a.com/x~y"),
+            create_http_pair_with_url("http://b.com/"),
+            create_http_pair_with_url("http://c.com/"),
+        ]
+
+        nogoods = set()
+        seen = []
+        for matching in ma.match_two_traces(trace, trace, backend="dp", nogoods=nogoods):
+            seen.append(matching_to_indices(matching, trace, trace))
+            nogoods.add((1, 1))
+        self.assertEqual(seen, [((0, 0), (1, 1), (2, 2)), ((0, 0), (2, 2))])
 
 
 if __name__ == '__main__':
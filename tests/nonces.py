@@ -0,0 +1,35 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+from my_http.my_http import HTTPRequest, HTTPResponse
+from helper.nonces_helper import NoncesHelper, PairDiffCache, PARALLEL_DIFF_THRESHOLD
+
+
+def create_json_pair(path, body):
+    request = HTTPRequest(raw_payload=b"GET %s HTTP/1.1\r\nHost: a.com\r\n\r\n" % path, https=True)
+    response = HTTPResponse(raw_payload=b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + body)
+    return request, response
+
+
+class TestPairDiffCache(unittest.TestCase):
+
+    def test_matchings_share_pair_differences(self):
+        count = PARALLEL_DIFF_THRESHOLD
+        trace1 = [create_json_pair(b"/%d" % i, b'{"t": "a%d", "u": "same"}' % i) for i in range(count)]
+        trace2 = [create_json_pair(b"/%d" % i, b'{"t": "b%d", "u": "same"}' % i) for i in range(count)]
+        matching = list(zip(trace1, trace2))
+        expected = NoncesHelper.find_nonces(matching)
+        self.assertEqual({(trace1[5][1], "a5", "json", "|t")}, {n for n in expected[1] if n[0] is trace1[5][1]})
+
+        with PairDiffCache(processes=2) as diff_cache:
+            self.assertEqual(expected, NoncesHelper.find_nonces(matching, diff_cache))
+            self.assertIsNotNone(diff_cache.executor)
+            diff_cache.close()
+            # a second matching only computes its new pairing
+            shifted = [(trace1[0], trace2[1])] + matching[2:]
+            self.assertEqual(NoncesHelper.find_nonces(shifted), NoncesHelper.find_nonces(shifted, diff_cache))
+            self.assertIsNone(diff_cache.executor)
+            self.assertEqual(len(matching) + 1, len(diff_cache.entries))
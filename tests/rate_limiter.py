@@ -0,0 +1,44 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+from config import CONFIGURATION
+from my_http.rate_limiter import RateLimiter
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_throttling_lowers_rate_and_honours_retry_after(self):
+        limiter = RateLimiter(CONFIGURATION["RATE_LIMIT"])
+        origin = "https://a.com"
+        for _ in range(CONFIGURATION["RATE_LIMIT"]["BURST"]):
+            self.assertEqual(0.0, limiter.reserve(origin))
+
+        rate = limiter.get_bucket(origin).rate
+        limiter.update(origin, Response(200))
+        self.assertGreater(limiter.get_bucket(origin).rate, rate)
+
+        limiter.update(origin, Response(429, {"retry-after": "30"}))
+        self.assertLess(limiter.get_bucket(origin).rate, rate)
+        self.assertGreater(limiter.reserve(origin), 29)
+        self.assertEqual(0.0, limiter.reserve("https://b.com"))
+
+    def test_only_idempotent_requests_are_retried_on_503(self):
+        limiter = RateLimiter(CONFIGURATION["RATE_LIMIT"])
+        self.assertTrue(limiter.should_retry("GET", Response(503)))
+        self.assertFalse(limiter.should_retry("POST", Response(503)))
+        self.assertTrue(limiter.should_retry("POST", Response(503, {"retry-after": "1"})))
+        self.assertTrue(limiter.should_retry("POST", Response(429)))
+        self.assertFalse(limiter.should_retry("GET", Response(200)))
+
+
+if __name__ == '__main__':
+    unittest.main()
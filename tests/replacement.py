@@ -0,0 +1,41 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+from my_http.my_http import HTTPRequest
+from helper.template_helper import RequestTemplates
+from helper.replacement_helper import MultiReplacer
+
+
+def create_request(request_line, headers):
+    return HTTPRequest(raw_payload=b"%s HTTP/1.1\r\nHost: a.com\r\n%s\r\n" % (request_line, headers), https=True)
+
+
+class TestRequestTemplates(unittest.TestCase):
+
+    def test_longest_nonce_wins_and_missing_ones_stay(self):
+        request = create_request(b"POST /a?x=abcdef&y=abc", b"X-Token: abcdef-zzz\r\nContent-Length: 10\r\n")
+        request.content = b"abc abcdef zzz"
+        templates = RequestTemplates({"abc", "abcdef", "zzz"})
+
+        url, headers, content = templates.render(request, {"abc": "1", "abcdef": "2"})
+
+        self.assertEqual("https://a.com/a?x=2&y=1", url)
+        self.assertEqual({"x-token": "2-zzz"}, headers)
+        self.assertEqual(b"1 2 zzz", content)
+        self.assertEqual(request.url, templates.render(request, {})[0])
+
+
+class TestAbstraction(unittest.TestCase):
+
+    def test_leftmost_longest_replacement(self):
+        replacer = MultiReplacer({"abc": "<1>", "abcdef": "<2>", "b.c": "<3>", "x": "<4>"})
+
+        self.assertEqual("<2>g <1>de ab<4> <3> b<4>c", replacer.replace("abcdefg abcde abx b.c bxc"))
+        self.assertEqual("abc", MultiReplacer({}).replace("abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+from my_http.my_http import HTTPRequest, HTTPResponse
+import tool
+from helper.dataflow_helper import NonceDataflowGraph
+
+
+def create_http_pair(request_line, headers=b"", body=b'{}'):
+    request = HTTPRequest(raw_payload=b"%s HTTP/1.1\r\nHost: a.com\r\n%s\r\n" % (request_line, headers), https=True)
+    response = HTTPResponse(raw_payload=b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + body)
+    return request, response
+
+
+class TestReplayDependencies(unittest.TestCase):
+
+    def test_dependencies_follow_nonces_and_oracle(self):
+        trace = [
+            create_http_pair(b"GET /token", body=b'{"token": "abcdef123456"}'),
+            create_http_pair(b"GET /static"),
+            create_http_pair(b"GET /profile", b"X-Token: abcdef123456\r\n"),
+            create_http_pair(b"POST /action"),
+            create_http_pair(b"GET /after"),
+        ]
+        response_nonce_set = {trace[0][1]: [("abcdef123456", "json", "token")]}
+
+        dependencies = tool.find_replay_dependencies(trace, response_nonce_set, trace[3])
+
+        self.assertEqual([set(), set(), {0}, {0, 1, 2}, {3}], dependencies)
+
+    def test_dataflow_graph_keeps_nonce_chain_to_oracle(self):
+        trace = [
+            create_http_pair(b"GET /session", body=b'{"session": "s3ss10n1d"}'),
+            create_http_pair(b"GET /static"),
+            create_http_pair(b"GET /token?session=s3ss10n1d", body=b'{"token": "abcdef123456"}'),
+            create_http_pair(b"GET /other", b"X-Token: abcdef123456\r\n"),
+            create_http_pair(b"POST /action", b"X-Token: abcdef123456\r\n"),
+        ]
+        response_nonce_set = {trace[0][1]: [("s3ss10n1d", "json", "session")],
+                              trace[2][1]: [("abcdef123456", "json", "token")]}
+
+        graph = NonceDataflowGraph(trace, response_nonce_set, tool.encoded_nonce_values)
+
+        self.assertEqual({0, 2, 4}, graph.required_for(4))
+        self.assertEqual([1, 3], graph.removal_order(4, graph.required_for(4)))
+        self.assertEqual(3, len(graph.edges))
+
+    def test_dataflow_graph_matches_request_fields(self):
+        trace = [
+            create_http_pair(b"GET /token", body=b'{"token": "abcdef123456", "flag": "true", "id": "98765"}'),
+            create_http_pair(b"GET /flags?enabled=true&x=abcdef1234567"),
+            create_http_pair(b"GET /other/98765x"),
+            create_http_pair(b"POST /action", b"Content-Type: application/json\r\n"),
+            create_http_pair(b"GET /item/98765", b"Cookie: a=1; t=abcdef123456\r\n"),
+        ]
+        trace[3][0].content = b'{"auth": {"t": "abcdef123456"}}'
+        response_nonce_set = {trace[0][1]: [("abcdef123456", "json", "|token"), ("true", "json", "|flag"),
+                                            ("98765", "json", "|id")]}
+
+        graph = NonceDataflowGraph(trace, response_nonce_set, tool.encoded_nonce_values)
+
+        self.assertEqual([(0, 3, ("abcdef123456", "json", "|token")), (0, 4, ("98765", "json", "|id")),
+                          (0, 4, ("abcdef123456", "json", "|token"))], sorted(graph.edges))
+
+    def test_only_divergences_on_the_way_to_the_oracle_abort(self):
+        trace = [
+            create_http_pair(b"GET /token", body=b'{"token": "abcdef123456", "unused": "zyxwvu987654"}'),
+            create_http_pair(b"GET /other", body=b'{"other": "qwerty456789"}'),
+            create_http_pair(b"GET /side", b"X-Other: qwerty456789\r\n"),
+            create_http_pair(b"POST /action", b"X-Token: abcdef123456\r\n"),
+        ]
+        response_nonce_set = {trace[0][1]: [("abcdef123456", "json", "token"), ("zyxwvu987654", "json", "unused")],
+                              trace[1][1]: [("qwerty456789", "json", "other")]}
+
+        fatal_statuses, fatal_nonces = tool.find_fatal_divergences(trace, response_nonce_set, trace[3])
+
+        self.assertEqual({3}, fatal_statuses)
+        self.assertEqual({(0, ("abcdef123456", "json", "token"))}, fatal_nonces)
+
+    def test_status_mismatch_of_a_supplier_only_aborts_without_its_nonces(self):
+        trace = [
+            create_http_pair(b"GET /token", body=b'{"token": "abcdef123456"}'),
+            create_http_pair(b"POST /action", b"X-Token: abcdef123456\r\n"),
+        ]
+        nonce = ("abcdef123456", "json", "|token")
+        response_nonce_set = {trace[0][1]: [nonce]}
+        fatal_divergences = tool.find_fatal_divergences(trace, response_nonce_set, trace[1])
+        request, response = trace[0]
+
+        def replay(body):
+            replayed = HTTPResponse(raw_payload=b"HTTP/1.1 201 Created\r\nContent-Type: application/json\r\n\r\n" +
+                                    body)
+            report = {}
+            tool.check_replayed_response(0, request, response, [replayed], response_nonce_set, trace[1], {},
+                                         fatal_divergences, False, report)
+            return report
+
+        self.assertEqual(0, replay(b'{"token": "fedcba654321"}')["diverged_at"])
+        with self.assertRaises(tool.ReplayAbortedException):
+            replay(b'{}')
+
+
+class TestDynamicPruning(unittest.TestCase):
+
+    def test_ddmin_finds_needed_pairs_with_few_replays(self):
+        trace = [create_http_pair(b"GET /%d" % i) for i in range(32)]
+        needed = [trace[3], trace[7], trace[20]]
+        removable = [index for index in range(32) if index != 20]
+        replays = []
+
+        def works(candidate):
+            replays.append(candidate)
+            return all(needed_pair in candidate for needed_pair in needed)
+
+        self.assertEqual(needed, tool.prune_after_ddmin(trace, removable, works))
+        self.assertLess(len(replays), 20)
+
+        replays.clear()
+        self.assertEqual(needed, tool.prune_after_linear(trace, removable, works))
+        self.assertEqual(31, len(replays))
+
+    def test_speculative_pruning_matches_sequential(self):
+        trace = [create_http_pair(b"GET /%d" % i) for i in range(32)]
+        needed = [trace[3], trace[7], trace[20]]
+        removable = [index for index in range(32) if index != 20]
+        batches = []
+
+        def replay_candidates(candidates):
+            batches.append(len(candidates))
+            return [all(needed_pair in candidate for needed_pair in needed) for candidate in candidates]
+
+        for strategy in [tool.prune_after_ddmin, tool.prune_after_linear]:
+            batches.clear()
+            self.assertEqual(needed, tool.prune_speculatively(strategy, trace, removable, replay_candidates, 4))
+            self.assertTrue(all(batch <= 4 for batch in batches))
+
+
+if __name__ == '__main__':
+    unittest.main()
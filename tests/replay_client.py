@@ -0,0 +1,34 @@
+import sys
+
+sys.path.append('../')
+
+import unittest
+
+import httpx
+
+from my_http.replay_client import ReplayClient
+
+
+def create_redirect(url, location, set_cookies=()):
+    response = httpx.Response(302, headers=[("set-cookie", set_cookie) for set_cookie in set_cookies],
+                              request=httpx.Request("GET", url))
+    response.next_request = httpx.Request("GET", location)
+    return response
+
+
+class TestRedirects(unittest.TestCase):
+
+    def test_cookies_only_follow_redirects_to_their_domain(self):
+        headers = {"Cookie": "sid=1; s=0"}
+        chain = [create_redirect("https://a.com/login", "https://a.com/next", ["s=2; Path=/", "d=3; Domain=a.com"])]
+        self.assertEqual("sid=1; s=2; d=3", ReplayClient.redirect_request(chain, headers)[3]["cookie"])
+
+        chain.append(create_redirect("https://a.com/next", "https://sub.a.com/", ["t=4"]))
+        self.assertEqual("d=3", ReplayClient.redirect_request(chain, headers)[3]["cookie"])
+
+        chain.append(create_redirect("https://sub.a.com/", "https://b.com/"))
+        self.assertNotIn("cookie", ReplayClient.redirect_request(chain, headers)[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
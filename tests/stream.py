@@ -0,0 +1,117 @@
+import sys
+
+sys.path.append('../')
+
+import os
+import tempfile
+import unittest
+
+from scapy.all import Ether, IP, IPv6, TCP, wrpcap
+from helper.pcap_helper import PcapHelper
+from helper.stream_helper import StreamHelper, SYN, FIN
+from helper.parsing_helper import ParsingHelper
+
+ACK = 0x10
+CLIENT = ("10.0.0.1", 50000)
+SERVER = ("10.0.0.2", 443)
+
+
+def segment(from_client, seq, payload, flags=ACK, client=CLIENT):
+    src, dst = (client, SERVER) if from_client else (SERVER, client)
+    return 0.0, src[0], src[1], dst[0], dst[1], seq, flags, payload
+
+
+def handshake(client=CLIENT):
+    return [
+        segment(True, 99, b"", SYN, client),
+        segment(False, 499, b"", SYN | ACK, client),
+    ]
+
+
+class TestStreamReassembly(unittest.TestCase):
+
+    def test_split_request_and_response(self):
+        request = b"POST /login HTTP/1.1\r\nHost: a.com\r\nContent-Length: 11\r\n\r\nuser=a&pw=b"
+        response = b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello"
+        segments = handshake() + [
+            segment(True, 100, request[:20]),
+            segment(True, 120, request[20:]),
+            segment(False, 500, response[:30]),
+            segment(False, 530, response[30:]),
+        ]
+
+        pairs = list(StreamHelper.iter_http_pairs(segments))
+
+        self.assertEqual(len(pairs), 1)
+        request, response = pairs[0]
+        self.assertEqual(request.url, "https://a.com/login")
+        self.assertEqual(request.content, b"user=a&pw=b")
+        self.assertEqual(response.content, b"hello")
+
+    def test_out_of_order_chunked_response(self):
+        request = b"GET / HTTP/1.1\r\nHost: a.com\r\n\r\n"
+        response = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n"
+        segments = handshake() + [
+            segment(True, 100, request),
+            segment(False, 520, response[20:]),
+            segment(False, 500, response[:20]),
+        ]
+
+        pairs = list(StreamHelper.iter_http_pairs(segments))
+
+        self.assertEqual(len(pairs), 1)
+        self.assertEqual(pairs[0][1].content, b"hello world")
+        self.assertEqual(pairs[0][1].headers["content-length"], "11")
+        self.assertNotIn("transfer-encoding", pairs[0][1].headers)
+
+    def test_pairing_per_flow(self):
+        other_client = ("10.0.0.3", 50001)
+        segments = handshake() + handshake(other_client) + [
+            segment(True, 100, b"GET /a HTTP/1.1\r\nHost: a.com\r\n\r\n"),
+            segment(True, 100, b"GET /b HTTP/1.1\r\nHost: a.com\r\n\r\n", client=other_client),
+            segment(False, 500, b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nb", client=other_client),
+            segment(False, 500, b"HTTP/1.1 200 OK\r\n\r\na"),
+            segment(False, 539, b"", FIN | ACK),
+        ]
+
+        pairs = list(StreamHelper.iter_http_pairs(segments))
+
+        self.assertEqual([(req.url, res.content) for req, res in pairs],
+                         [("https://a.com/b", b"b"), ("https://a.com/a", b"a")])
+
+    def test_sharded_parse_equals_sequential(self):
+        clients = [("10.0.0.%d" % i, 50000 + i) for i in range(3, 11)]
+        segments = []
+        for client in clients:
+            segments += handshake(client)
+        for i, client in enumerate(clients):
+            segments.append(segment(True, 100, b"GET /%d HTTP/1.1\r\nHost: a.com\r\n\r\n" % i, client=client))
+        for i, client in enumerate(reversed(clients)):
+            if i % 2:
+                segments.append(segment(False, 500, b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\nx", client=client))
+            else:
+                # no content length, the flows are still open at the end of the capture
+                segments.append(segment(False, 500, b"HTTP/1.1 200 OK\r\n\r\ny", client=client))
+
+        sequential = [(req.url, res.content) for req, res in StreamHelper.iter_http_pairs(segments)]
+        self.assertEqual(len(clients), len(sequential))
+        for shards in range(2, 5):
+            sharded = ParsingHelper.parse_pcap_segments_sharded(iter(segments), shards, batch_size=3)
+            self.assertEqual(sequential, [(req.url, res.content) for req, res in sharded])
+
+    def test_native_reader_equals_scapy(self):
+        packets = [Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=50000, dport=443, seq=100) / b"GET",
+                   Ether() / IPv6(src="fe80::1", dst="2001:db8::2") / TCP(sport=443, dport=50000, seq=500) / b"HTTP"]
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "capture.pcap")
+            wrpcap(file, packets)
+
+            native = [segment[:7] + (bytes(segment[7]),) for segment in PcapHelper.iter_tcp_segments(file)]
+            scapy = list(ParsingHelper.iter_pcap_segments_scapy(file))
+
+        self.assertEqual(scapy, native)
+        self.assertEqual(("10.0.0.1", "10.0.0.2"), (native[0][1], native[0][3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,19 +2,30 @@
 
 from termcolor import colored
 import json
-import httpx as requests
-from lxml import etree
 from urllib.parse import quote, unquote
 from base64 import b64decode, b64encode
-from sys import exit
-import time
+from sys import exit, argv
+from itertools import islice
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from helper.parsing_helper import ParsingHelper as pa
 from helper.pruning_helper import PruningHelper as pu
 from helper.matching_helper import MatchingHelper as ma
-from helper.nonces_helper import NoncesHelper as no
+from helper.nonces_helper import NoncesHelper as no, PairDiffCache
+from helper.cache_helper import AnalysisCache
+from helper.dataflow_helper import NonceDataflowGraph
+from helper.journal_helper import ReplayJournal
+from helper.template_helper import RequestTemplates
+from helper.replacement_helper import MultiReplacer
 from config import TYPES, USE_ORACLE, ORACLE, KNOWN_STRINGS, CONFIGURATION
-from helper.my_exceptions import OracleNotUsedException
+from helper.my_exceptions import OracleNotUsedException, ReplayAbortedException
+from my_http.replay_client import ReplayClient, AsyncReplayClient
+from my_http.body_view import BodyView
+
+
+# how many matchings of the unranked order are enumerated to measure the replays saved by ranking
+MAX_UNRANKED_MATCHINGS = 10000
 
 
 def fail(string):
@@ -40,112 +51,178 @@ def prune_before(pairs):
     return pairs
 
 
-def prune_after(pairs, response_nonce_set, oracle_pair):
-    minimal_prefix = []
-    prunable_postfix = pairs[:]
-
-    while len(prunable_postfix) > 0:
-        if debug:
-            print("Testing %d/%d (%s)..." %
-                  (len(minimal_prefix) + 1, len(minimal_prefix) + len(prunable_postfix), prunable_postfix[0][0].url),
-                  end=" ")
-
-        worked = False
-        if prunable_postfix[0] != oracle_pair:
-            candidate_trace = minimal_prefix + prunable_postfix[1:]
-            worked = replay_trace_with_nonce_retrieval(candidate_trace, response_nonce_set, oracle_pair)
-        elif debug:
-            print("Oracle pair", end=" -> ")
+class StopSpeculation(Exception):
+    pass
 
-        if not worked:
-            if debug:
-                fail("Needed\n")
-            minimal_prefix += [prunable_postfix[0]]
-        elif debug:
-            success("Pruned\n")
-        prunable_postfix = prunable_postfix[1:]
 
-        print("Sleeping for %d secs between dynamic replay runs... " % time_between_dynamic_pruning_runs)
-        time.sleep(time_between_dynamic_pruning_runs)
+def prune_after(pairs, response_nonce_set, oracle_pair, journal=None):
+    strategy = prune_after_ddmin if CONFIGURATION["DYNAMIC_PRUNING_STRATEGY"] == "ddmin" else prune_after_linear
+    graph = NonceDataflowGraph(pairs, response_nonce_set, encoded_nonce_values)
+    oracle_index = pairs.index(oracle_pair)
+    required = graph.required_for(oracle_index) if CONFIGURATION["KEEP_REQUIRED_PAIRS"] else {oracle_index}
+    removable = graph.removal_order(oracle_index, required)
+    print("Pairs on a nonce chain to the oracle pair, kept without replaying: %d" % (len(required) - 1))
+    parallel_replays = CONFIGURATION["PARALLEL_PRUNING_REPLAYS"]
+    budget = CONFIGURATION["PRUNING_REQUEST_BUDGET"]
+    replays = 0
+    sent_requests = 0
+    indices = {id(pair): index for index, pair in enumerate(pairs)}
 
-    return minimal_prefix
+    def journal_key(candidate_trace):
+        return [len(pairs), oracle_index, [indices[id(pair)] for pair in candidate_trace]]
 
+    def replay_candidate(candidate_trace):
+        if debug:
+            print("Testing without %d of %d pairs..." % (len(pairs) - len(candidate_trace), len(pairs)))
+        worked = replay_with_journal(journal, "pruning", journal_key(candidate_trace), candidate_trace,
+                                     response_nonce_set, oracle_pair)
+        if debug and worked:
+            success("Pruned\n")
+        elif debug:
+            fail("Needed\n")
+        return worked
+
+    def replay_candidates(candidate_traces):
+        nonlocal replays, sent_requests
+        journaled = [journal.lookup("pruning", journal_key(candidate_trace)) if journal is not None else None
+                     for candidate_trace in candidate_traces]
+        if any(entry is not None for entry in journaled):
+            print("Outcome of %d replays loaded from the journal" % sum(entry is not None for entry in journaled))
+            unknown = [candidate_trace for candidate_trace, entry in zip(candidate_traces, journaled) if entry is None]
+            replayed = iter(replay_candidates(unknown) if unknown else [])
+            return [next(replayed) if entry is None else entry["verdict"] for entry in journaled]
+
+        if budget is not None:
+            # candidates beyond the request budget are kept as needed without replaying them
+            affordable = []
+            for candidate_trace in candidate_traces:
+                if sent_requests + len(candidate_trace) > budget:
+                    break
+                sent_requests += len(candidate_trace)
+                affordable.append(candidate_trace)
+            if len(affordable) < len(candidate_traces):
+                print("Request budget of %d exhausted, keeping the remaining pairs" % budget)
+        else:
+            affordable = candidate_traces
+            sent_requests += sum(len(candidate_trace) for candidate_trace in candidate_traces)
+
+        if len(affordable) > 1:
+            with ThreadPoolExecutor(len(affordable)) as executor:
+                results = list(executor.map(replay_candidate, affordable))
+        else:
+            results = [replay_candidate(candidate_trace) for candidate_trace in affordable]
+        replays += len(affordable)
+        return results + [False] * (len(candidate_traces) - len(affordable))
+
+    if parallel_replays > 1:
+        minimal_trace = prune_speculatively(strategy, pairs, removable, replay_candidates, parallel_replays)
+    else:
+        minimal_trace = strategy(pairs, removable, lambda candidate_trace: replay_candidates([candidate_trace])[0])
+    print("Dynamic pruning kept %d of %d pairs using %d replays (%d requests)" %
+          (len(minimal_trace), len(pairs), replays, sent_requests))
+
+    if CONFIGURATION["DATAFLOW_GRAPH_FILE"]:
+        kept = {index for index, pair in enumerate(pairs) if pair in minimal_trace}
+        graph.export(CONFIGURATION["DATAFLOW_GRAPH_FILE"], oracle_index, kept)
+        print("Written the nonce dataflow graph to %s" % CONFIGURATION["DATAFLOW_GRAPH_FILE"])
+    return minimal_trace
+
+
+def prune_speculatively(strategy, pairs, removable, replay_candidates, parallel_replays):
+    """
+    Runs the pruning strategy with the outcomes of its next candidates predicted (the more frequent outcome so far)
+    to find the next parallel_replays candidates, replays them at once and reruns the strategy with the real
+    outcomes. Mispredicted candidates are replayed in vain, but the result is the same as running it sequentially.
+    """
+    results = {}
+    while True:
+        outcomes = list(results.values())
+        prediction = outcomes.count(True) >= outcomes.count(False)
+        pending = {}
+
+        def works(candidate_trace):
+            key = tuple(id(pair) for pair in candidate_trace)
+            if key in results:
+                return results[key]
+            pending[key] = candidate_trace
+            if len(pending) >= parallel_replays:
+                raise StopSpeculation
+            return prediction
+
+        try:
+            minimal_trace = strategy(pairs, removable, works)
+            if not pending:
+                return minimal_trace
+        except StopSpeculation:
+            pass
+        results.update(zip(pending, replay_candidates(list(pending.values()))))
+
+
+def prune_after_linear(pairs, removable, works):
+    # tries to remove one of the removable pairs (indices in the order to try them) after the other
+    kept = set(range(len(pairs)))
+    for index in removable:
+        candidate = kept - {index}
+        if works([pairs[i] for i in sorted(candidate)]):
+            kept = candidate
+    return [pairs[index] for index in sorted(kept)]
+
+
+def prune_after_ddmin(pairs, removable, works):
+    """
+    Delta debugging: tries to remove whole chunks of the removable pairs at once, starting with all of them,
+    and halves the chunk size once no chunk of the current size can be removed.
+    If only k of the n pairs are needed, this takes about k * log(n) instead of n replays.
+    """
+    kept = set(range(len(pairs)))
+    removable = list(removable)
+    chunk_size = len(removable)
+    while chunk_size >= 1:
+        start = 0
+        while start < len(removable):
+            candidate = kept.difference(removable[start:start + chunk_size])
+            if works([pairs[index] for index in sorted(candidate)]):
+                kept = candidate
+                del removable[start:start + chunk_size]
+            else:
+                start += chunk_size
+        chunk_size //= 2
+    return [pairs[index] for index in sorted(kept)]
 
-def prepare_request_for_replay(request, real_nonces):
-    req_headers = request.get_headers_for_replay()
-    req_content = request.content
-    req_url = request.url
 
-    # sort nonces by length descending (longest first)
-    old_nonces = sorted(list(real_nonces), key=len, reverse=True)
+def prepare_request_for_replay(request, real_nonces, templates):
+    # splices the new nonces into the template of the request, see RequestTemplate
+    return templates.render(request, real_nonces)
 
-    # Replace all old nonces in the request with the new nonces
-    for old_nonce in old_nonces:
-        new_nonce = real_nonces[old_nonce]
-        req_headers = {header: req_headers[header].replace(old_nonce, new_nonce) for header in req_headers}
-        if 'content-length' in req_headers:
-            del req_headers['content-length']
-        if 'date' in req_headers:
-            del req_headers['date']
-        req_content = req_content.replace(old_nonce.encode(), new_nonce.encode())
-        req_url = req_url.replace(old_nonce, new_nonce)
 
-    return req_url, req_headers, req_content
+def get_request_templates(response_nonce_set):
+    # the templates are reused as long as the replays use the same nonces, e.g. during dynamic pruning
+    global request_templates
+    if request_templates is None or request_templates[0] is not response_nonce_set:
+        patterns = set()
+        for nonces in response_nonce_set.values():
+            for val, _, _ in nonces:
+                patterns |= encoded_nonce_values(val)
+        request_templates = response_nonce_set, RequestTemplates(patterns)
+    return request_templates[1]
 
 
-def retrieve_nonces(expected_response, actual_response, response_nonce_set, real_nonces):
-    # Parse real response to retrieve nonces from it
+def retrieve_nonces(expected_response, actual_responses, response_nonce_set, real_nonces):
+    # Parse real responses (all hops of a redirect chain) to retrieve nonces from them,
+    # returns the nonces that couldn't be retrieved
+    missing_nonces = []
     if expected_response in response_nonce_set:
         if debug:
             print("Should be able to retrieve: ", response_nonce_set[expected_response])
         for val, id, key in response_nonce_set[expected_response]:
             new_nonce = None
-            if id == "json":
-                if actual_response.headers["content-type"].startswith("application/json"):
-                    content = actual_response.text
-                    if len(content.split("\n")[0]) == 4:  # begins with )]}' or )]}"
-                        content = content[5:]
-                    parsed_json_content = json.loads(content)
-                    flattend = {key: str(value) for key, value in pa.flatten_json(parsed_json_content)}
-                    if key in flattend:
-                        new_nonce = flattend[key]
-            elif id == "form-urlencoded":
-                parsed = pa.parse_form_url_encoded(actual_response.text)
-                new_nonce = parsed[key]
-            elif id == "set-cookie" and "set-cookie" in actual_response.headers:
-                set_cookie_headers = [value.decode() for key, value in actual_response.headers.raw if
-                                      key.decode().lower() == "set-cookie"]
-                for set_cookie_header in set_cookie_headers:
-                    name, value = pa.parse_set_cookie_header(set_cookie_header)
-                    if key == name:
-                        new_nonce = value
-            elif id.startswith("meta-redirect-"):
-                url_part = id[len("meta-redirect-"):]
-                if actual_response.status_code == 302:  # some sites randomly choose to use location header or meta redirect
-                    meta_refresh_url = actual_response.headers["location"]
-                else:
-                    meta_refresh_url = pa.parse_meta_refresh_url_from_content(actual_response.content.decode())
-                if meta_refresh_url:
-                    new_nonce = pa.get_url_part(meta_refresh_url, url_part, key)
-            elif id.startswith("location-"):
-                part = id[len("location-"):]
-                location_url = None
-                if actual_response.status_code == 200:  # some sites randomly choose to use location header or meta redirect
-                    meta_redirect_url = pa.parse_meta_refresh_url_from_content(actual_response.content.decode())
-                    if meta_redirect_url:
-                        location_url = meta_redirect_url
-                elif "location" in actual_response.headers:
-                    location_url = actual_response.headers["location"]
-                if location_url:
-                    new_nonce = pa.get_url_part(location_url, part, key)
-            elif id == "html-hidden-input":
-                dom = etree.HTML(actual_response.content.decode())
-                elements = dom.xpath(key)
-                if len(elements) > 0:
-                    new_nonce = elements[0].get("value")
-
-            elif debug:
-                fail("I don't know nonces of type %s" % id)
+            for actual_response in actual_responses:
+                try:
+                    new_nonce = extract_nonce(actual_response, id, key)
+                except (KeyError, IndexError, ValueError, AttributeError):
+                    new_nonce = None  # the hop doesn't contain the nonce in the expected form
+                if new_nonce:
+                    break
 
             if new_nonce:
                 if debug:
@@ -154,24 +231,55 @@ def retrieve_nonces(expected_response, actual_response, response_nonce_set, real
                 val = best_effort_decode(val)
                 new_nonce = best_effort_decode(new_nonce)
 
-                def base64encode(val):
-                    return b64encode(val.encode()).decode()
-
-                def base64decode(val):
-                    return b64decode(val.encode()).decode()
-
-                def quote_with_slash(val):
-                    return quote(val, safe='')
-
-                encodings = [quote_with_slash, unquote, base64encode, base64decode, lambda x: x]
-
-                for encoding in encodings:
+                for encoding in NONCE_ENCODINGS:
                     try:
                         real_nonces[encoding(val)] = encoding(new_nonce)
                     except Exception:
                         pass
-            elif debug:
-                fail("Couldn't retrieve new nonce {}({})".format(id, key))
+            else:
+                missing_nonces.append((val, id, key))
+                if debug:
+                    fail("Couldn't retrieve new nonce {}({})".format(id, key))
+    return missing_nonces
+
+
+def extract_nonce(actual_response, id, key):
+    new_nonce = None
+    view = BodyView.of(actual_response)
+    if id == "json":
+        if view.content_type == "application/json":
+            value = view.json_leaf(key)
+            if value is not None:
+                new_nonce = str(value)
+    elif id == "form-urlencoded":
+        new_nonce = view.form_params[key]
+    elif id == "set-cookie":
+        new_nonce = view.set_cookies.get(key)
+    elif id.startswith("meta-redirect-"):
+        url_part = id[len("meta-redirect-"):]
+        if actual_response.status_code == 302:  # some sites randomly choose to use location header or meta redirect
+            meta_refresh_url = actual_response.headers["location"]
+        else:
+            meta_refresh_url = view.meta_refresh_url
+        if meta_refresh_url:
+            new_nonce = pa.get_url_part(meta_refresh_url, url_part, key)
+    elif id.startswith("location-"):
+        part = id[len("location-"):]
+        location_url = None
+        if actual_response.status_code == 200:  # some sites randomly choose to use location header or meta redirect
+            meta_redirect_url = view.meta_refresh_url
+            if meta_redirect_url:
+                location_url = meta_redirect_url
+        elif "location" in actual_response.headers:
+            location_url = actual_response.headers["location"]
+        if location_url:
+            new_nonce = pa.get_url_part(location_url, part, key)
+    elif id == "html-hidden-input":
+        new_nonce = view.hidden_inputs.get(key)
+
+    elif debug:
+        fail("I don't know nonces of type %s" % id)
+    return new_nonce
 
 
 def best_effort_decode(value):
@@ -194,51 +302,252 @@ def best_effort_decode(value):
     return value
 
 
-def replay_trace_with_nonce_retrieval(trace, response_nonce_set, oracle_pair, show_debug=None):
+def base64encode(val):
+    return b64encode(val.encode()).decode()
+
+
+def base64decode(val):
+    return b64decode(val.encode()).decode()
+
+
+def quote_with_slash(val):
+    return quote(val, safe='')
+
+
+# the forms a retrieved nonce is replaced in
+NONCE_ENCODINGS = [quote_with_slash, unquote, base64encode, base64decode, lambda x: x]
+
+
+def encoded_nonce_values(val):
+    values = set()
+    for encoding in NONCE_ENCODINGS:
+        try:
+            values.add(encoding(best_effort_decode(val)))
+        except Exception:
+            pass
+    values.discard("")
+    return values
+
+
+def find_replay_dependencies(trace, response_nonce_set, oracle_pair):
+    """
+    Returns for every pair of the trace the indices of the earlier pairs that have to be replayed before it:
+    the pairs whose responses supply a nonce its request carries. The oracle pair happens after all earlier pairs
+    and all later pairs happen after the oracle pair.
+    """
+    graph = NonceDataflowGraph(trace, response_nonce_set, encoded_nonce_values)
+    oracle_index = trace.index(oracle_pair) if oracle_pair in trace else len(trace)
+    dependencies = []
+    for index in range(len(trace)):
+        if index == oracle_index:
+            dependencies.append(set(range(index)))
+        elif index > oracle_index:
+            dependencies.append(graph.suppliers[index] | {oracle_index})
+        else:
+            dependencies.append(set(graph.suppliers[index]))
+    return dependencies
+
+
+def status_matches(expected_status, actual_status):
+    return actual_status == expected_status or actual_status in [200, 302] and expected_status in [200, 302]
+
+
+def replay_trace_with_nonce_retrieval(trace, response_nonce_set, oracle_pair, show_debug=None, report=None):
+    """
+    Replays the trace and returns the verdict of the ORACLE on the oracle pair.
+    If a report dict is given, the index of the first pair whose replay diverged from the recording
+    (unfixable status code or nonces that couldn't be retrieved) is stored as "diverged_at".
+    A divergence the FAIL_FAST rules consider fatal for the oracle pair stops the replay, it fails and its index is
+    stored as "aborted_at".
+    """
     global debug
     local_debug = debug
     if show_debug is not None:
         local_debug = show_debug
     real_nonces = {}
-    session = requests
     return_value = None
+    fatal_divergences = find_fatal_divergences(trace, response_nonce_set, oracle_pair)
+
+    try:
+        if CONFIGURATION["REPLAY_MODE"] == "async":
+            return_value = asyncio.run(replay_trace_concurrently(trace, response_nonce_set, oracle_pair, real_nonces,
+                                                                 fatal_divergences, local_debug, report))
+        else:
+            with ReplayClient() as session:
+                try:
+                    return_value = replay_trace_with_session(session, trace, response_nonce_set, oracle_pair,
+                                                             real_nonces, fatal_divergences, local_debug, report)
+                finally:
+                    if report is not None:
+                        report["timings"] = session.timings
+    except ReplayAbortedException as exception:
+        if local_debug:
+            fail("\tReplay aborted at %s, the oracle can't succeed anymore" % trace[exception.index][0].url)
+        if report is not None:
+            report["aborted_at"] = exception.index
+        return_value = False
+
+    if report is not None:
+        report["nonces"] = real_nonces
+    if return_value is None:
+        raise OracleNotUsedException
+    return return_value
 
-    for request, response in trace:
-        req_url, req_headers, req_content = prepare_request_for_replay(request, real_nonces)
+
+def find_fatal_divergences(trace, response_nonce_set, oracle_pair):
+    """
+    Returns the indices of the pairs whose status mismatch the FAIL_FAST rules let abort the replay, and the
+    (index, nonce) tuples of the nonces whose absence does. Only the oracle pair and the pairs on a nonce chain
+    leading to it can make the oracle fail, so only their divergences are fatal. A status mismatch is only fatal
+    for the oracle pair itself, a pair on the chain may still deliver the nonces the oracle needs.
+    """
+    rules = CONFIGURATION["FAIL_FAST"]
+    if not rules["ENABLED"] or oracle_pair not in trace:
+        return set(), set()
+
+    def is_fatal(nonce_type):
+        return any(nonce_type == rule_type or nonce_type.startswith(rule_type + "-")
+                   for rule_type, fatal in rules["MISSING_NONCE_TYPES"].items() if fatal)
+
+    graph = NonceDataflowGraph(trace, response_nonce_set, encoded_nonce_values)
+    oracle_index = trace.index(oracle_pair)
+    required = graph.required_for(oracle_index)
+    fatal_statuses = {oracle_index} if rules["STATUS_MISMATCH"] else set()
+    return fatal_statuses, {(supplier, nonce) for supplier, consumer, nonce in graph.edges
+                            if consumer in required and is_fatal(nonce[1])}
+
+
+def replay_with_journal(journal, kind, key, trace, response_nonce_set, oracle_pair, show_debug=None, report=None):
+    """
+    Like replay_trace_with_nonce_retrieval, but takes the outcome from the journal if the candidate with this key
+    was already replayed and writes the outcome of new replays to it.
+    """
+    if report is None:
+        report = {}
+    entry = journal.lookup(kind, key) if journal is not None else None
+    if entry is not None:
+        print("Outcome of this replay loaded from the journal")
+        if entry["diverged_at"] is not None:
+            report["diverged_at"] = entry["diverged_at"]
+        return entry["verdict"]
+
+    verdict = replay_trace_with_nonce_retrieval(trace, response_nonce_set, oracle_pair, show_debug, report)
+    if journal is not None:
+        journal.record(kind, key, verdict=bool(verdict), diverged_at=report.get("diverged_at"),
+                       aborted_at=report.get("aborted_at"),
+                       statuses=report["statuses"], nonces=report["nonces"],
+                       urls=[request.url for request, _ in trace])
+    return verdict
+
+
+def replay_trace_with_session(session, trace, response_nonce_set, oracle_pair, real_nonces, fatal_divergences,
+                              local_debug, report):
+    return_value = None
+    templates = get_request_templates(response_nonce_set)
+    for index, (request, response) in enumerate(trace):
+        req_url, req_headers, req_content = prepare_request_for_replay(request, real_nonces, templates)
 
         print("Requesting %s " % req_url)
 
-        res = session.request(request.method, req_url, data=req_content, headers=req_headers, allow_redirects=False)
+        res = session.request(request.method, req_url, content=req_content, headers=req_headers)
+        if local_debug:
+            print("\t%s" % ReplayClient.format_timing(session.timings[-1]))
 
-        if res.status_code != response.status_code:
-            if not (res.status_code == response.status_code or
-                    res.status_code in [200, 302] and response.status_code in [200, 302]):
-                if local_debug:
-                    fail("\tSomething is wrong (Expected: %d, Got: %d)" % (response.status_code, res.status_code))
-            else:
-                if local_debug:
-                    print("\tTrying to fix this by allowing redirects... ", end="")
-                res = session.request(request.method, req_url, data=req_content, headers=req_headers,
-                                      allow_redirects=True)
-                if local_debug:
-                    if res.status_code != response.status_code:
-                        fail("\tSomething is wrong again! (Expected: %d, Got: %d)" % (
-                            response.status_code, res.status_code))
-                    else:
-                        success("\tFixing it seems to have worked!")
-
-        if res.status_code == response.status_code or res.status_code in [200, 302] and response.status_code in [200,
-                                                                                                                 302]:
-            retrieve_nonces(response, res, response_nonce_set, real_nonces)
-
-        if (request, response) == oracle_pair:
-            return_value = ORACLE(res.status_code, res.headers, res.content)
+        responses = [res]
+        if res.status_code != response.status_code and status_matches(response.status_code, res.status_code):
+            if local_debug:
+                print("\tTrying to fix this by following the redirects... ", end="")
+            responses = session.follow_redirects(res, req_headers)
+            if local_debug:
+                print_redirect_fix(response, responses[-1])
+
+        verdict = check_replayed_response(index, request, response, responses, response_nonce_set, oracle_pair,
+                                          real_nonces, fatal_divergences, local_debug, report)
+        if verdict is not None:
+            return_value = verdict
 
-    if return_value is None:
-        raise OracleNotUsedException
     return return_value
 
 
+async def replay_trace_concurrently(trace, response_nonce_set, oracle_pair, real_nonces, fatal_divergences, local_debug,
+                                    report):
+    """
+    Replays every pair as soon as the pairs supplying its nonces are replayed,
+    so the replay takes about as long as the longest nonce chain instead of the whole trace.
+    """
+    dependencies = find_replay_dependencies(trace, response_nonce_set, oracle_pair)
+    templates = get_request_templates(response_nonce_set)
+    verdicts = []
+    tasks = []
+
+    async def replay_pair(index):
+        await asyncio.gather(*[tasks[dependency] for dependency in dependencies[index]])
+        request, response = trace[index]
+        req_url, req_headers, req_content = prepare_request_for_replay(request, real_nonces, templates)
+
+        print("Requesting %s " % req_url)
+
+        res = await session.request(request.method, req_url, content=req_content, headers=req_headers)
+        responses = [res]
+        if res.status_code != response.status_code and status_matches(response.status_code, res.status_code):
+            responses = await session.follow_redirects(res, req_headers)
+            if local_debug:
+                print_redirect_fix(response, responses[-1])
+
+        verdict = check_replayed_response(index, request, response, responses, response_nonce_set, oracle_pair,
+                                          real_nonces, fatal_divergences, local_debug, report)
+        if verdict is not None:
+            verdicts.append(verdict)
+
+    async with AsyncReplayClient() as session:
+        tasks += [asyncio.ensure_future(replay_pair(index)) for index in range(len(trace))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        if report is not None:
+            report["timings"] = session.timings
+
+    return verdicts[-1] if verdicts else None
+
+
+def print_redirect_fix(expected_response, actual_response):
+    if actual_response.status_code != expected_response.status_code:
+        fail("\tSomething is wrong again! (Expected: %d, Got: %d)" % (
+            expected_response.status_code, actual_response.status_code))
+    else:
+        success("\tFixing it seems to have worked!")
+
+
+def check_replayed_response(index, request, response, responses, response_nonce_set, oracle_pair, real_nonces,
+                            fatal_divergences, local_debug, report):
+    # retrieves the new nonces from the replayed responses (all hops of a followed redirect)
+    # and returns the verdict of the ORACLE on the oracle pair
+    res = responses[-1]
+    fatal_statuses, fatal_nonces = fatal_divergences
+    status_diverged = not status_matches(response.status_code, res.status_code)
+    if status_diverged and local_debug:
+        fail("\tSomething is wrong (Expected: %d, Got: %d)" % (response.status_code, res.status_code))
+    # the nonces are retrieved even on a status mismatch, the replay only fails if the needed ones are gone too
+    missing_nonces = retrieve_nonces(response, responses, response_nonce_set, real_nonces)
+    diverged = status_diverged or len(missing_nonces) > 0
+    fatal = (status_diverged and index in fatal_statuses) or \
+        any((index, nonce) in fatal_nonces for nonce in missing_nonces)
+
+    if report is not None:
+        report.setdefault("statuses", []).append((index, res.status_code))
+        if diverged:
+            report["diverged_at"] = min(index, report.get("diverged_at", index))
+
+    if (request, response) == oracle_pair:
+        return ORACLE(res.status_code, res.headers, res.content)
+    if fatal:
+        raise ReplayAbortedException(index)
+    return None
+
+
 def get_type_of_string(string):
     for regex, name in TYPES:
         if regex.fullmatch(string):
@@ -263,28 +572,20 @@ def prepare_nonce_sets_for_abstraction(request_nonces, response_nonces):
     return prepared_nonces
 
 
-def replace_all_in_string(string, replacements):
-    new_string = string
-    for old_val in replacements:
-        new_val = replacements[old_val]
-        new_string = new_string.replace(old_val, new_val)
-    return new_string
-
-
 def abstract_trace(trace, replacements):
+    replacer = MultiReplacer(replacements)
     abstracted_trace = []
     for req, res in trace:
         def replace_headers_and_content(http):
             abstracted_headers = {
-                header: replace_all_in_string(http.headers[header], replacements)
+                header: replacer.replace(http.headers[header])
                 for header in http.headers if header != "set-cookie"
             }
             if "set-cookie" in http.headers:
-                abstracted_headers["set-cookie"] = [replace_all_in_string(value, replacements) for value in
-                                                    http.headers["set-cookie"]]
+                abstracted_headers["set-cookie"] = [replacer.replace(value) for value in http.headers["set-cookie"]]
 
             try:
-                abstracted_content = replace_all_in_string(http.content.decode(), replacements)
+                abstracted_content = replacer.replace(http.content.decode())
             except UnicodeDecodeError:
                 return abstracted_headers, None
 
@@ -295,7 +596,7 @@ def abstract_trace(trace, replacements):
         if abstracted_content is None:
             continue
         abstracted_request = {
-            "url": replace_all_in_string(req.url, replacements),
+            "url": replacer.replace(req.url),
             "headers": abstracted_headers,
             "method": req.method,
             "content": abstracted_content
@@ -339,16 +640,26 @@ def determine_file_names():
     return file1, file2, output_file
 
 
-def parse_input_files(file1, file2):
-    pairs1 = pa.parse_file(file1)
-    print("Pairs before pruning: %d" % len(pairs1))
-    pairs1 = prune_before(pairs1)
+def parse_input_files(file1, file2, analysis_cache):
+    files = [file1, file2]
+    traces = [analysis_cache.load_trace("pruned", i) for i in range(2)]
+    parsed = [analysis_cache.load_trace("parsed", i) if traces[i] is None else None for i in range(2)]
+
+    to_parse = [i for i in range(2) if traces[i] is None and parsed[i] is None]
+    for i, pairs in zip(to_parse, pa.parse_files([files[i] for i in to_parse])):
+        analysis_cache.store_trace("parsed", i, pairs)
+        parsed[i] = pairs
 
-    pairs2 = pa.parse_file(file2)
-    print("Pairs before pruning: %d" % len(pairs2))
-    pairs2 = prune_before(pairs2)
+    for i in range(2):
+        if traces[i] is not None:
+            print("Statically pruned pairs loaded from the analysis cache: %d" % len(traces[i]))
+            continue
+        print("Pairs before pruning: %d" % len(parsed[i]))
+        traces[i] = prune_before(parsed[i])
+        analysis_cache.store_trace("pruned", i, traces[i], parsed[i])
 
-    return pairs1, pairs2
+    analysis_cache.set_traces(traces[0], traces[1])
+    return traces[0], traces[1]
 
 
 def write_result_file(output_file, pruned_pairs, request_nonces, response_nonces):
@@ -373,15 +684,49 @@ def write_result_file(output_file, pruned_pairs, request_nonces, response_nonces
     print("Finished! Written the output to %s" % output_file)
 
 
-def find_valid_matching(possible_matches, trace1):
+def count_unranked_replays(found_match, trace1, trace2, nogoods):
+    # the number of replays the plain longest first order would have needed to reach the found matching, it gets
+    # the nogoods learned by the ranked run from the start, so it rather underestimates the saved replays
+    found_indices = [(id(pair1), id(pair2)) for pair1, pair2 in found_match]
+    replays = 0
+    for matching in islice(ma.match_two_traces(trace1, trace2, ranked=False, nogoods=set(nogoods)),
+                           MAX_UNRANKED_MATCHINGS):
+        if any(USE_ORACLE(pair1) for pair1, _ in matching):
+            replays += 1
+        if [(id(pair1), id(pair2)) for pair1, pair2 in matching] == found_indices:
+            return replays
+    return None
+
+
+def report_saved_replays(found_match, replays, trace1, trace2, nogoods):
+    unranked_replays = count_unranked_replays(found_match, trace1, trace2, nogoods)
+    if unranked_replays is None:
+        print("Replays needed: %d (not within the first %d unranked matchings)" % (replays, MAX_UNRANKED_MATCHINGS))
+    else:
+        print("Replays needed: %d (unranked: %d, saved: %d)" % (replays, unranked_replays, unranked_replays - replays))
+
+
+def find_valid_matching(possible_matches, trace1, trace2, analysis_cache, nogoods, diff_cache, journal=None):
     first_match, found, trace, request_nonces, response_nonces, oracle_pair = None, False, None, None, None, None
     i = 1
+    replays = 0
+    indices1 = {id(pair): index for index, pair in enumerate(trace1)}
+    indices2 = {id(pair): index for index, pair in enumerate(trace2)}
     for possible_match in possible_matches:
+        matched_indices = [(indices1[id(pair1)], indices2[id(pair2)]) for pair1, pair2 in possible_match]
+        if any(indices in nogoods for indices in matched_indices):
+            # cached matchings or matchings enumerated before the nogood was learned
+            i += 1
+            continue
         if first_match is None:
             first_match = possible_match
-        request_nonces, response_nonces = no.find_nonces(possible_match)
+        request_nonces, response_nonces = analysis_cache.find_nonces(
+            possible_match, lambda matching: no.find_nonces(matching, diff_cache))
         trace = [pair1 for pair1, _ in possible_match]
 
+        if debug and hasattr(possible_match, "score"):
+            print("Matching %d with %d pairs, similarity score %.2f" % (i, len(possible_match), possible_match.score))
+
         if print_urls:
             print("\nMatched URLs:")
             for pair in trace1:
@@ -411,17 +756,29 @@ def find_valid_matching(possible_matches, trace1):
         oracle_pair = [p for p in trace if USE_ORACLE(p)][-1]
         response_nonce_set = prepare_response_nonces(response_nonces)
 
-        if replay_trace_with_nonce_retrieval(trace, response_nonce_set, oracle_pair, False):
+        replays += 1
+        report = {}
+        if replay_with_journal(journal, "matching", matched_indices, trace, response_nonce_set, oracle_pair, False,
+                               report):
             found = True
             success("Replay worked")
+            if CONFIGURATION["REPORT_SAVED_REPLAYS"] and CONFIGURATION["MATCHING_BACKEND"] == "dp" \
+                    and CONFIGURATION["RANK_MATCHINGS"]:
+                report_saved_replays(possible_match, replays, trace1, trace2, nogoods)
             break
         fail("Replay failed")
+        if CONFIGURATION["LEARN_NOGOODS"] and "diverged_at" in report:
+            # no later matching may contain the pairing the replay diverged at
+            nogood = matched_indices[report["diverged_at"]]
+            nogoods.add(nogood)
+            print("Replay diverged at %s, excluding this pairing from further matchings" %
+                  possible_match[report["diverged_at"]][0][0].url)
         i += 1
     return first_match, found, oracle_pair, request_nonces, response_nonce_set, response_nonces, trace
 
 
 def pruned_found_matching(first_match, found, oracle_pair, request_nonces, response_nonce_set, response_nonces,
-                          trace):
+                          trace, diff_cache, journal=None):
     if found:
         if debug:
             print("Nonces that can't be retrieved during replaying, "
@@ -436,11 +793,11 @@ def pruned_found_matching(first_match, found, oracle_pair, request_nonces, respo
                 print("> " + request.url)
             print()
 
-        pruned_pairs = prune_after(trace, response_nonce_set, oracle_pair)
+        pruned_pairs = prune_after(trace, response_nonce_set, oracle_pair, journal)
     else:
         fail("Found no replayable matching")
         print("Found no match of the two traces that is replayable. Using first match and skipping dynamic pruning.")
-        request_nonces, response_nonces = no.find_nonces(first_match)
+        request_nonces, response_nonces = no.find_nonces(first_match, diff_cache)
         pruned_pairs = [pair1 for pair1, _ in first_match]
 
         if print_urls:
@@ -454,22 +811,38 @@ def pruned_found_matching(first_match, found, oracle_pair, request_nonces, respo
     return pruned_pairs, request_nonces, response_nonces
 
 
-time_between_dynamic_pruning_runs = CONFIGURATION["TIME_BETWEEN_DYNAMIC_PRUNING_RUNS"]
 debug = CONFIGURATION["DEBUG"]
+request_templates = None
 print_urls = CONFIGURATION["SHOULD_PRINT_URLS_FOR_MATCHINGS"]
 
 
 def main():
     file1, file2, output_file = determine_file_names()
-    trace1, trace2 = parse_input_files(file1, file2)
-    possible_matches = ma.match_two_traces(trace1, trace2)
-
-    first_match, found, oracle_pair, request_nonces, response_nonce_set, response_nonces, found_trace = \
-        find_valid_matching(possible_matches, trace1)
-
-    pruned_pairs, request_nonces, response_nonces = pruned_found_matching(first_match, found, oracle_pair,
-                                                                          request_nonces, response_nonce_set,
-                                                                          response_nonces, found_trace)
+    analysis_cache = AnalysisCache(file1, file2)
+    trace1, trace2 = parse_input_files(file1, file2, analysis_cache)
+    nogoods = set()
+    possible_matches = analysis_cache.matchings(lambda: ma.match_two_traces(trace1, trace2, nogoods=nogoods), nogoods)
+    # with --resume the replays of an interrupted run on the same inputs with the same oracle are taken from its
+    # journal instead of being sent again
+    journal = None
+    if CONFIGURATION["REPLAY_JOURNAL_FILE"]:
+        journal = ReplayJournal(CONFIGURATION["REPLAY_JOURNAL_FILE"], "--resume" in argv[1:],
+                                {"inputs": analysis_cache.input_key, "oracle": analysis_cache.oracle_fingerprint()})
+        if journal.ignored:
+            print(colored("Ignored %d journal entries of runs on other inputs or with another oracle" %
+                          journal.ignored, "blue"))
+
+    with PairDiffCache() as diff_cache:
+        first_match, found, oracle_pair, request_nonces, response_nonce_set, response_nonces, found_trace = \
+            find_valid_matching(possible_matches, trace1, trace2, analysis_cache, nogoods, diff_cache, journal)
+        possible_matches.close()  # stores the matchings generated so far
+
+        pruned_pairs, request_nonces, response_nonces = pruned_found_matching(first_match, found, oracle_pair,
+                                                                              request_nonces, response_nonce_set,
+                                                                              response_nonces, found_trace,
+                                                                              diff_cache, journal)
+    if journal is not None:
+        journal.close()
     print("#" * 400)
 
     write_result_file(output_file, pruned_pairs, request_nonces, response_nonces)